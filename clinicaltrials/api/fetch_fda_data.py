@@ -1,15 +1,31 @@
 """"
-Code for collecting data from the FDA API and outputting to a JSON file.
+Code for collecting data from the FDA API and outputting to a gzipped JSON file.
 Written by Alison Spencer.
 """
 
-import time
-import requests
+import argparse
+import gzip
 import json
+import os
 import pathlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from itertools import repeat
+from rate_limit import RateLimiter
+from telemetry import FetchMetrics
+import http_client
+
+FDA_API_URL = os.environ.get("CLINICALTRIALS_FDA_API_URL",
+                             "https://api.fda.gov/drug/drugsfda.json")
+
+# openFDA refuses to skip past this many results, so queries with more
+# results are split into date ranges that each have fewer
+MAX_SKIP = 25000
 
 
-def make_fda_api_call(skip, limit=1000, start_date="2003-01-01", end_date="2024-02-19"):
+def make_fda_api_call(skip, limit=1000, start_date="2003-01-01", end_date="2024-02-19",
+                      metrics=None):
     """
     Makes an API call to FDA's Drugs@FDA API.
 
@@ -24,28 +40,48 @@ def make_fda_api_call(skip, limit=1000, start_date="2003-01-01", end_date="2024-
         -end_date: (str) the end date of submission_status_date used in 
         results. For the project, this is set to 2/19/2024 to align with our 
         final data collection.
+        -metrics: (FetchMetrics) if given, records the request's metrics.
 
     Returns:
-        - response.json(): the json file for that specific page and query.
+        - response.json(): the json file for that specific page and query,
+        or None if the query has no results at this skip.
     """
 
-    base_url = "https://api.fda.gov/drug/drugsfda.json?search=submissions.submission_status_date"
+    base_url = FDA_API_URL + "?search=submissions.submission_status_date"
     # FDA API has trouble parsing parameters, which is why the url is being input
     # into requests as a string.
     second_part_url = "%5B" + start_date + "%20TO%20" + end_date + "%5D"
     third_part_url = "&skip=" + str(skip) + "&limit=" + str(limit)
     url = base_url + second_part_url + third_part_url
-    response = requests.get(url)
-    if response.status_code != 200:
+    response = http_client.get(url)
+    # openFDA answers a query with no (more) results with a 404. Any other
+    # error has already been retried, so it should fail the pull rather than
+    # silently truncate it.
+    if response.status_code == 404:
+        if metrics:
+            metrics.record_page(response, 0.0, 0)
         return None
-    return response.json()
+    response.raise_for_status()
+
+    decode_start = time.perf_counter()
+    data = response.json()
+    if metrics:
+        metrics.record_page(response, time.perf_counter() - decode_start,
+                            len(data["results"]))
+    return data
 
 
 def pull_fda_api_data(
-    skip=0, limit=1000, start_date="2003-01-01", end_date="2024-02-19"
+    skip=0, limit=1000, start_date="2003-01-01", end_date="2024-02-19",
+    max_workers=4, requests_per_second=4
 ):
     """
-    Pull data for the given time frame from the Drugs@FDA API.
+    Pull data for the given time frame from the Drugs@FDA API. The first page
+    reports the total number of results, so the remaining skip windows are
+    known up front and are fetched concurrently by a pool of workers sharing
+    one rate limiter. Pages are still written out in skip order. openFDA
+    cannot page past MAX_SKIP results, so a date range with more results is
+    split in halves, which are pulled in turn.
 
     Args:
         - skip: (int) value initially sent to 0. used to paginate.
@@ -58,47 +94,123 @@ def pull_fda_api_data(
         -end_date: (str) the end date of submission_status_date used in 
         results. For the project, this is set to 2/19/2024 to align with our 
         final data collection.
+        -max_workers: (int) the number of pages fetched in parallel.
+        -requests_per_second: (float) the request budget shared by all
+        workers. The openFDA API allows 240 requests per minute without a key.
 
     Returns:
-        - Writes data from the API out to a json file.
+        - Writes data from the API out to a newline-delimited json file, one
+        record per line, as each page arrives.
     """
-    results = []
-    while True:
-        time.sleep(2)
-        apicall = make_fda_api_call(
-            skip, limit=1000, start_date="2003-01-01", end_date="2024-02-19"
+    # Start from an empty file, then append each page as it is pulled
+    write_data([], "fda", append=False)
+
+    limiter = RateLimiter(requests_per_second)
+    metrics = FetchMetrics("fda")
+
+    def fetch_page(page_skip, range_start, range_end):
+        limiter.wait()
+        return make_fda_api_call(
+            page_skip, limit=limit, start_date=range_start,
+            end_date=range_end, metrics=metrics
         )
-        if apicall is None:
-            break
 
-        results.append(apicall)
-        skip += limit
-        write_data(results, "fda", append=False)
+    # An application with submissions in more than one date range is
+    # returned for each of them, and only written the first time
+    seen = set()
+
+    def write_new(records):
+        new_records = []
+        for record in records:
+            key = record.get("application_number")
+            if key is None or key not in seen:
+                seen.add(key)
+                new_records.append(record)
+        write_data(new_records, "fda")
+
+    ranges = [(start_date, end_date)]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while ranges:
+            range_start, range_end = ranges.pop(0)
+            first_page = fetch_page(skip, range_start, range_end)
+            if first_page is None:
+                continue
+
+            total = first_page["meta"]["results"]["total"]
+            if total > MAX_SKIP + limit:
+                halves = split_date_range(range_start, range_end)
+                if halves:
+                    ranges[:0] = halves
+                    continue
+                print(f"Warning: only the first {MAX_SKIP + limit} of "
+                      f"{total} applications with submissions on "
+                      f"{range_start} can be pulled")
+
+            write_new(first_page["results"])
+            # map yields pages in skip order regardless of completion order
+            skips = range(skip + limit, min(total, MAX_SKIP + 1), limit)
+            for apicall in executor.map(fetch_page, skips,
+                                        repeat(range_start),
+                                        repeat(range_end)):
+                if apicall is None:
+                    break
+                write_new(apicall["results"])
+
+    metrics.write_summary(sleep_seconds=limiter.slept_seconds)
+
+
+def split_date_range(start_date, end_date):
+    """
+    Splits a range of dates in two halves.
+
+    Args:
+        start_date (str): The first date of the range, as YYYY-MM-DD
+        end_date (str): The last date of the range, as YYYY-MM-DD
+
+    Returns:
+        list: The (start_date, end_date) of each half, or an empty list if
+        the range is a single day.
+    """
+    start = date.fromisoformat(start_date)
+    end = date.fromisoformat(end_date)
+    if start >= end:
+        return []
+    middle = start + (end - start) // 2
+    return [(start.isoformat(), middle.isoformat()),
+            ((middle + timedelta(days=1)).isoformat(), end.isoformat())]
 
 
 def write_data(data, source, append=True):
     """
-    Writes data returned by an API call to a JSON file format.
+    Writes records returned by an API call to a gzipped newline-delimited
+    JSON file, one record per line.
 
     Args:
-        data (JSON): Data returned from an API call
-        filename ('str'): The name of the file to write to
+        data (list): Records returned from an API call
+        source ('str'): The name of the file to write to
         append (bool): Default to true. If true, will append to the filename
-        wrather than overwrite it.
+        rather than overwrite it.
 
     Returns:
         None. Creates or appends to the file specified.
     """
 
     if append:
-        mode = 'a'
+        mode = 'at'
     else:
-        mode = 'w'
+        mode = 'wt'
 
-    pth = pathlib.Path(__file__).parent / f"../../data/{source}.json"
+    pth = pathlib.Path(__file__).parent / f"../../data/{source}.jsonl.gz"
 
-    with open(pth, mode=mode) as f:
-        f.write(json.dumps(data))
+    with gzip.open(pth, mode=mode) as f:
+        for record in data:
+            f.write(json.dumps(record) + "\n")
 
 if __name__ == "__main__":
-    pull_fda_api_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests-per-second", type=float, default=4,
+                        help="request budget; 0 disables throttling, e.g. "
+                        "when replaying or using the stand-in server")
+    args = parser.parse_args()
+
+    pull_fda_api_data(requests_per_second=args.requests_per_second)
\ No newline at end of file
@@ -2,12 +2,23 @@
 Pulls records from the Clinical Trials API. Written by Caitlin Pratt.
 """
 
-import requests
+import argparse
+import datetime
+import gzip
 import json
-import time
+import os
 import pathlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from rate_limit import RateLimiter
+from telemetry import FetchMetrics
+import http_client
+
+API_URL = os.environ.get('CLINICALTRIALS_TRIALS_API_URL',
+                         'https://www.clinicaltrials.gov/api/v2/studies')
 
-API_URL = 'https://www.clinicaltrials.gov/api/v2/studies'
+DATA_DIR = pathlib.Path(__file__).parent / '../../data'
 
 API_FIELDS = ['NCTId', 'BriefTitle', 'OfficialTitle', 'Condition',
               'StatusModule', 'InterventionName', 'InterventionOtherName',
@@ -19,13 +30,15 @@ API_FIELDS = ['NCTId', 'BriefTitle', 'OfficialTitle', 'Condition',
 
 def make_trials_api_call(
     fields, limit_per_call,
-        pageToken=None,
+        pageToken=None, extra_filters=(),
 ) -> {json, str}:
     """
     Makes an API call to NIH's clinical trials API.
 
     Args:
         - Fields, list: A list of fields to be returned from the API
+        - extra_filters, list: Additional AREA[...] expressions ANDed onto
+          the postFilter.advanced expression
 
     Returns:
         - Dict: The returned JSON payload from the API call, and the
@@ -33,14 +46,15 @@ def make_trials_api_call(
     """
 
     fields = '|'.join(fields)
+    advanced = ' AND '.join(
+        ['AREA[IsFDARegulatedDrug]true AND AREA[Phase](PHASE3 OR PHASE4)',
+         *extra_filters])
     payload = {'fields': fields, 'query.intr': 'AREA[InterventionType]DRUG',
                'pageToken': pageToken, 'pageSize': limit_per_call,
-               'postFilter.advanced':
-               'AREA[IsFDARegulatedDrug]true AND AREA[Phase](PHASE3 OR PHASE4)',
+               'postFilter.advanced': advanced,
                'query.locn': 'AREA[LocationCountry]United States'}
 
-    r = requests.get(
-        'https://www.clinicaltrials.gov/api/v2/studies', params=payload)
+    r = http_client.get(API_URL, params=payload)
 
     r.raise_for_status()
 
@@ -49,78 +63,453 @@ def make_trials_api_call(
 
 def write_data(data, source, append=True):
     """
-    Writes data returned by an API call to a JSON file format.
+    Writes records returned by an API call to a gzipped newline-delimited
+    JSON file, one record per line. Each call appends a separate gzip member,
+    so the file can be truncated back to the end of any earlier call.
 
     Args:
-        data (JSON): Data returned from an API call
-        filename ('str'): The name of the file to write to
+        data (list): Records returned from an API call
+        source ('str'): The name of the file to write to
         append (bool): Default to true. If true, will append to the filename
-        wrather than overwrite it.
+        rather than overwrite it.
 
     Returns:
-        None. Creates or appends to the file specified.
+        int: The size of the file in bytes after writing.
     """
 
     if append:
-        mode = 'a'
+        mode = 'at'
     else:
-        mode = 'w'
+        mode = 'wt'
+
+    pth = raw_path(source)
+
+    with gzip.open(pth, mode=mode) as f:
+        for record in data:
+            f.write(json.dumps(record) + '\n')
+
+    return pth.stat().st_size
+
+
+def raw_path(source):
+    """
+    Returns the path of the raw data file for a source.
+    """
+    return DATA_DIR / f"{source}.jsonl.gz"
+
+
+def load_checkpoint(source):
+    """
+    Loads the pagination checkpoint left by an unfinished pull, if any.
+
+    Args:
+        source ('str'): The name of the raw data file being pulled
+
+    Returns:
+        Dict with the next page token, record count and file size at the
+        last completed page, or None if there is nothing to resume.
+    """
+    pth = DATA_DIR / f"{source}.checkpoint.json"
+    if not pth.exists():
+        return None
+
+    with open(pth) as f:
+        return json.load(f)
+
+
+def write_checkpoint(source, checkpoint):
+    """
+    Atomically saves the pagination checkpoint after a completed page, so a
+    crash mid-write never leaves a corrupt checkpoint behind.
 
-    pth = pathlib.Path(__file__).parent / f"../../data/{source}.json"
+    Args:
+        source ('str'): The name of the raw data file being pulled
+        checkpoint (dict): The next page token, record count and file size
+    """
+    pth = DATA_DIR / f"{source}.checkpoint.json"
+    tmp_pth = DATA_DIR / f"{source}.checkpoint.json.tmp"
+
+    with open(tmp_pth, mode='w') as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_pth, pth)
+
+
+def clear_checkpoint(source):
+    """
+    Removes the pagination checkpoint once a pull has finished.
+    """
+    pth = DATA_DIR / f"{source}.checkpoint.json"
+    if pth.exists():
+        pth.unlink()
+
+
+def get_last_update(study):
+    """
+    Returns the last update post date (YYYY-MM-DD) of one study, or None.
+    """
+    return study.get('protocolSection', {}).get('statusModule', {})\
+        .get('lastUpdatePostDateStruct', {}).get('date')
 
-    with open(pth, mode=mode) as f:
-        f.write(json.dumps(data))
+
+def get_nct_id(study):
+    """
+    Returns the nctId of one study.
+    """
+    return study.get('protocolSection', {}).get('identificationModule', {})\
+        .get('nctId')
+
+
+def load_sync_state():
+    """
+    Loads the last-update high-water mark recorded by the previous pull.
+
+    Returns:
+        str: The latest last update post date seen, or None if no pull has
+        recorded one.
+    """
+    pth = DATA_DIR / 'trials_sync.json'
+    if not pth.exists():
+        return None
+
+    with open(pth) as f:
+        return json.load(f)['last_update']
+
+
+def write_sync_state(last_update):
+    """
+    Records the last-update high-water mark for the next delta sync.
+    """
+    pth = DATA_DIR / 'trials_sync.json'
+    with open(pth, mode='w') as f:
+        json.dump({'last_update': last_update}, f)
 
 
 def pull_trials_data(limit_per_call=1000, limit_total=float('inf'),
-                     fields=API_FIELDS):
+                     fields=API_FIELDS, resume=True, source='trials',
+                     extra_filters=(), limiter=None, metrics=None):
     """
-    Pulls trials data, and writes it to a JSON file.
+    Pulls trials data, and writes it to a newline-delimited JSON file. Each
+    page is appended to the file as it arrives, and the next page token is
+    checkpointed afterwards, so an interrupted pull can pick up from the last
+    good page.
+
     Args:
         limit_per_call (int): The maximum number of calls to return per
             call to the api. Cannot be more than 1000.
         limit_total (int): The maximum total number of records to return.
+        fields (list): A list of fields to be returned from the API
+        resume (bool): Default to true. If true and a checkpoint from an
+            unfinished pull exists, resumes from its next page token.
+        source (str): The name of the raw data file to write to
+        extra_filters (list): Additional AREA[...] expressions used to
+            narrow the query
+        limiter (RateLimiter): Paces requests. Share one limiter between
+            concurrent pulls. Defaults to one request every two seconds.
+        metrics (FetchMetrics): Records per-page metrics. Share one between
+            concurrent pulls and write its summary when they finish. If not
+            given, the pull writes its own summary.
+
+    Returns:
+        str: The latest last update post date among the pulled studies.
     """
+    extra_filters = list(extra_filters)
+    if limiter is None:
+        limiter = RateLimiter(0.5)
+    owns_metrics = metrics is None
+    if owns_metrics:
+        metrics = FetchMetrics(source)
+    checkpoint = load_checkpoint(source) if resume else None
+
+    if checkpoint and checkpoint['fields'] == fields \
+            and checkpoint['filters'] == extra_filters:
+        next_page_token = checkpoint['next_page_token']
+        count_results = checkpoint['count']
+        last_update = checkpoint['last_update']
+        # Drop anything written after the last checkpointed page
+        with open(raw_path(source), mode='r+b') as f:
+            f.truncate(checkpoint['bytes'])
+        print(f"Resuming API pull of {source} after {count_results} records")
+    else:
+        next_page_token = None
+        count_results = 0
+        last_update = None
+        write_data([], source, append=False)
+        print(
+            f"Making initial API call for {source} records between 0 and {limit_per_call}"
+        )
+
+    while True:
+        limiter.wait()
+        r = make_trials_api_call(limit_per_call=limit_per_call,
+                    fields=fields, pageToken=next_page_token,
+                    extra_filters=extra_filters)
+
+        decode_start = time.perf_counter()
+        response = r.json()
+        studies = response.get('studies', [])
+        metrics.record_page(r, time.perf_counter() - decode_start,
+                            len(studies))
+        for study in studies:
+            study_update = get_last_update(study)
+            if study_update and (last_update is None
+                                 or study_update > last_update):
+                last_update = study_update
+        size = write_data(studies, source)
+        count_results += len(studies)
+        next_page_token = response.get('nextPageToken')
+
+        if not next_page_token or \
+                count_results + limit_per_call > limit_total:
+            print(f"API pull of {source} complete.")
+            break
 
-    print(
-        f"Making initial API call for records between 0 and {limit_per_call}"
-    )
+        write_checkpoint(source, {'next_page_token': next_page_token,
+                                  'count': count_results, 'bytes': size,
+                                  'fields': fields, 'filters': extra_filters,
+                                  'last_update': last_update})
 
-    # Make initial API call, grab next page token to handle in for loop
-    results = []
+        next_results = count_results + limit_per_call
+        print(f"Pulling {source} records {count_results} to {next_results}")
 
-    response = make_trials_api_call(
-        limit_per_call=limit_per_call, fields=fields).json()
+    clear_checkpoint(source)
+    if owns_metrics:
+        metrics.write_summary(sleep_seconds=limiter.slept_seconds)
 
-    results = response['studies']
+    return last_update
 
-    count_results = limit_per_call
 
-    next_page_token = response['nextPageToken']
+def merge_trials_data(delta_source, source='trials'):
+    """
+    Merges a pull of changed studies into the existing raw data file by
+    nctId. Changed studies replace their old record in place, and studies
+    not seen before are appended. The existing file is streamed, so only
+    the (small) set of changed studies is held in memory.
 
-    while next_page_token and count_results + limit_per_call <= limit_total:
-        time.sleep(2)
+    Args:
+        delta_source (str): The name of the raw data file of changed studies
+        source (str): The name of the raw data file to merge into
 
-        try:
-            next_results = count_results + limit_per_call
+    Returns:
+        tuple: The number of studies replaced and the number added.
+    """
+    changed = {}
+    with gzip.open(raw_path(delta_source), mode='rt') as f:
+        for line in f:
+            study = json.loads(line)
+            changed[get_nct_id(study)] = line
+
+    pth = raw_path(source)
+    tmp_pth = DATA_DIR / f"{source}.jsonl.gz.tmp"
+    replaced = 0
+
+    with gzip.open(pth, mode='rt') as src, \
+            gzip.open(tmp_pth, mode='wt') as out:
+        for line in src:
+            nct_id = get_nct_id(json.loads(line))
+            if nct_id in changed:
+                line = changed.pop(nct_id)
+                replaced += 1
+            out.write(line)
+        for line in changed.values():
+            out.write(line)
+    os.replace(tmp_pth, pth)
+
+    return replaced, len(changed)
+
+
+def make_start_date_shards(first_year=2003, last_year=None,
+                           years_per_shard=2):
+    """
+    Splits the trials query into independent shards by study start date.
+    Together the shards cover every study: the first is open-ended into the
+    past, the last is open-ended into the future, and a final shard catches
+    studies with no start date.
 
-            print(f"Pulling clinical trial records {count_results} to {next_results}")
+    Args:
+        first_year (int): The first year given its own shard
+        last_year (int): The last year given its own shard. Defaults to the
+            current year.
+        years_per_shard (int): The number of start years in each shard
 
-            response = make_trials_api_call(limit_per_call=limit_per_call,
-                        fields=fields, pageToken=next_page_token).json()
+    Returns:
+        list: AREA[StartDate] expressions, one per shard.
+    """
+    if last_year is None:
+        last_year = datetime.date.today().year
+
+    shards = [f'AREA[StartDate]RANGE[MIN,{first_year - 1}-12-31]']
+    for year in range(first_year, last_year + 1, years_per_shard):
+        end_year = year + years_per_shard - 1
+        if end_year >= last_year:
+            shards.append(f'AREA[StartDate]RANGE[{year}-01-01,MAX]')
+            break
+        shards.append(f'AREA[StartDate]RANGE[{year}-01-01,{end_year}-12-31]')
+    shards.append('AREA[StartDate]MISSING')
 
-            next_page_token = response['nextPageToken']
+    return shards
 
-            results.extend(response['studies'])
 
-            count_results += limit_per_call
+def merge_shards(shard_sources, source='trials'):
+    """
+    Concatenates the raw data files of each shard into one file, in shard
+    order, dropping studies already seen in an earlier shard.
 
-        except KeyError:
-            print("API pull complete.")
-            results.extend(response['studies'])
-            break
+    Args:
+        shard_sources (list): The names of the shard raw data files
+        source (str): The name of the raw data file to write to
+
+    Returns:
+        int: The number of distinct studies written.
+    """
+    seen = set()
+    tmp_pth = DATA_DIR / f"{source}.jsonl.gz.tmp"
+
+    with gzip.open(tmp_pth, mode='wt') as out:
+        for shard_source in shard_sources:
+            with gzip.open(raw_path(shard_source), mode='rt') as f:
+                for line in f:
+                    nct_id = get_nct_id(json.loads(line))
+                    if nct_id not in seen:
+                        seen.add(nct_id)
+                        out.write(line)
+    os.replace(tmp_pth, raw_path(source))
+
+    for shard_source in shard_sources:
+        raw_path(shard_source).unlink()
+
+    return len(seen)
+
+
+def pull_trials_sharded(shards=None, max_workers=4, requests_per_second=0.8,
+                        limit_per_call=1000, fields=API_FIELDS, resume=True):
+    """
+    Pulls trials data as several independent shards, each paginated by its
+    own worker, then merges them into one raw data file de-duplicated by
+    nctId. Each shard is checkpointed separately, and shards that already
+    finished are not pulled again when an interrupted run is resumed.
+
+    Args:
+        shards (list): AREA[...] expressions, one per shard. Defaults to
+            make_start_date_shards().
+        max_workers (int): The number of shards pulled at once
+        requests_per_second (float): The request budget shared by all
+            workers. The clinical trials API allows about 50 requests per
+            minute, so the speedup over a serial pull is capped by this
+            budget, not by the number of shards or workers.
+        limit_per_call (int): The maximum number of calls to return per
+            call to the api. Cannot be more than 1000.
+        fields (list): A list of fields to be returned from the API
+        resume (bool): Default to true. If true, resumes an unfinished pull.
+
+    Returns:
+        str: The latest last update post date among the pulled studies.
+    """
+    if shards is None:
+        shards = make_start_date_shards()
+
+    state_pth = DATA_DIR / 'trials_shards.json'
+    state = None
+    if resume and state_pth.exists():
+        with open(state_pth) as f:
+            state = json.load(f)
+    if state is None or state['shards'] != shards:
+        state = {'shards': shards, 'done': {}}
+
+    limiter = RateLimiter(requests_per_second)
+    metrics = FetchMetrics('trials')
+    state_lock = threading.Lock()
+
+    def pull_shard(i):
+        shard_source = f'trials_shard_{i}'
+        if shard_source in state['done']:
+            return
+        last_update = pull_trials_data(
+            limit_per_call=limit_per_call, fields=fields, resume=resume,
+            source=shard_source, extra_filters=[shards[i]], limiter=limiter,
+            metrics=metrics)
+        with state_lock:
+            state['done'][shard_source] = last_update
+            with open(state_pth, mode='w') as f:
+                json.dump(state, f)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # list() re-raises the first error from any shard
+        list(executor.map(pull_shard, range(len(shards))))
+
+    count = merge_shards([f'trials_shard_{i}' for i in range(len(shards))])
+    print(f"Merged {len(shards)} shards into {count} records.")
+    state_pth.unlink()
+    metrics.write_summary(sleep_seconds=limiter.slept_seconds)
+
+    return max((last_update for last_update in state['done'].values()
+                if last_update), default=None)
+
+
+def sync_trials_data(limit_per_call=1000, fields=API_FIELDS, resume=True,
+                     requests_per_second=0.5):
+    """
+    Refreshes the raw trials data incrementally. Only studies updated since
+    the high-water mark left by the previous pull are queried, and they are
+    merged into the existing raw data by nctId. Falls back to a full pull
+    when no previous pull has been recorded.
+
+    Args:
+        limit_per_call (int): The maximum number of calls to return per
+            call to the api. Cannot be more than 1000.
+        fields (list): A list of fields to be returned from the API
+        resume (bool): Default to true. If true, resumes an unfinished pull.
+        requests_per_second (float): The request budget
+    """
+    limiter = RateLimiter(requests_per_second)
+    since = load_sync_state()
+    if since is None or not raw_path('trials').exists():
+        print("No previous pull recorded, pulling all records.")
+        write_sync_state(pull_trials_data(limit_per_call=limit_per_call,
+                                          fields=fields, resume=resume,
+                                          limiter=limiter))
+        return
+
+    # The range is inclusive, so studies updated later on the same day as
+    # the high-water mark are not missed. Merging them again is harmless.
+    print(f"Pulling clinical trial records updated since {since}")
+    delta_update = pull_trials_data(
+        limit_per_call=limit_per_call, fields=fields, resume=resume,
+        source='trials_delta',
+        extra_filters=[f'AREA[LastUpdatePostDate]RANGE[{since},MAX]'],
+        limiter=limiter)
+
+    replaced, added = merge_trials_data('trials_delta')
+    raw_path('trials_delta').unlink()
+    print(f"Merged {replaced} updated and {added} new records.")
+
+    write_sync_state(max(since, delta_update or since))
 
-    write_data(results, 'trials', append=False)
 
 if __name__ == "__main__":
-    pull_trials_data()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--delta', action='store_true',
+                        help='only pull studies updated since the last pull')
+    parser.add_argument('--restart', action='store_true',
+                        help='ignore any checkpoint from an unfinished pull')
+    parser.add_argument('--sharded', action='store_true',
+                        help='pull start date shards in parallel')
+    parser.add_argument('--requests-per-second', type=float,
+                        help='request budget, by default 0.8 for a sharded '
+                        'pull and 0.5 otherwise; 0 disables throttling, '
+                        'e.g. when replaying or using the stand-in server')
+    args = parser.parse_args()
+
+    # Without a budget given, each kind of pull keeps its own default
+    budget = {}
+    if args.requests_per_second is not None:
+        budget = {'requests_per_second': args.requests_per_second}
+
+    if args.delta:
+        sync_trials_data(resume=not args.restart, **budget)
+    elif args.sharded:
+        write_sync_state(pull_trials_sharded(resume=not args.restart,
+                                             **budget))
+    else:
+        limiter = RateLimiter(**budget) if budget else None
+        write_sync_state(pull_trials_data(resume=not args.restart,
+                                          limiter=limiter))
\ No newline at end of file
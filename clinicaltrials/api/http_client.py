@@ -0,0 +1,218 @@
+"""
+Shared HTTP client used by the API fetchers. All requests go through one
+pooled session, so connections are kept alive between pages, and transient
+failures (connection errors, 429 and 5xx responses) are retried with
+jittered exponential backoff.
+
+Responses can also be recorded to, and replayed from, a local cache keyed by
+the full request url. The mode is taken from the CLINICALTRIALS_HTTP_MODE
+environment variable:
+    - live (default): always make the request
+    - record: always make the request, and save the response
+    - replay: serve saved responses, and record any that are missing
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import pathlib
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+# Statuses worth saving: a page of data, or openFDA's "no more results"
+CACHEABLE_STATUSES = {200, 404}
+
+HTTP_MODE = os.environ.get('CLINICALTRIALS_HTTP_MODE', 'live')
+
+CACHE_DIR = pathlib.Path(os.environ.get(
+    'CLINICALTRIALS_HTTP_CACHE',
+    pathlib.Path(__file__).parent / '../../data/http_cache'))
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session(pool_size=10):
+    """
+    Returns the session shared by every fetcher, creating it on first use.
+
+    Args:
+        pool_size (int): The number of connections kept open per host. Should
+            be at least the number of threads making requests.
+
+    Returns:
+        requests.Session
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+            _session.headers.update({'Accept-Encoding': 'gzip, deflate'})
+        return _session
+
+
+def retry_delay(attempt, response=None, backoff=1, max_backoff=60):
+    """
+    Works out how long to wait before retrying a request. A Retry-After
+    header sent by the server is respected; otherwise the delay is drawn
+    uniformly between zero and an exponentially growing cap.
+
+    Args:
+        attempt (int): The number of the attempt that just failed, from 0
+        response (requests.Response): The failed response, if there was one
+        backoff (float): The cap on the delay after the first failure
+        max_backoff (float): The largest cap on the delay
+
+    Returns:
+        float: Seconds to wait.
+    """
+    retry_after = response.headers.get('Retry-After') \
+        if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), max_backoff)
+        except ValueError:
+            try:
+                wait = parsedate_to_datetime(retry_after).timestamp() \
+                    - time.time()
+                return min(max(wait, 0), max_backoff)
+            except (TypeError, ValueError):
+                pass
+
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+def cache_path(url):
+    """
+    Returns the path of the cached response for a full request url.
+    """
+    key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+    return CACHE_DIR / f"{key}.json.gz"
+
+
+def load_cached(url):
+    """
+    Rebuilds a saved response for a full request url.
+
+    Returns:
+        requests.Response, or None if the url has not been recorded.
+    """
+    pth = cache_path(url)
+    if not pth.exists():
+        return None
+
+    with gzip.open(pth, mode='rt') as f:
+        entry = json.load(f)
+
+    response = requests.Response()
+    response.url = entry['url']
+    response.status_code = entry['status_code']
+    response.headers = CaseInsensitiveDict(entry['headers'])
+    response.encoding = 'utf-8'
+    response._content = entry['content'].encode('utf-8')
+    return response
+
+
+def save_cached(url, response):
+    """
+    Saves a response for a full request url, if it is worth replaying.
+    """
+    if response.status_code not in CACHEABLE_STATUSES:
+        return
+
+    # The body is saved decoded, so transfer headers no longer apply
+    headers = {key: value for key, value in response.headers.items()
+               if key.lower() not in ('content-encoding', 'content-length',
+                                      'transfer-encoding')}
+    entry = {'url': url, 'status_code': response.status_code,
+             'headers': headers,
+             'content': response.content.decode('utf-8')}
+
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    pth = cache_path(url)
+    tmp_pth = pth.with_suffix('.tmp')
+    with gzip.open(tmp_pth, mode='wt') as f:
+        json.dump(entry, f)
+    os.replace(tmp_pth, pth)
+
+
+def get(url, params=None, max_retries=5, timeout=60):
+    """
+    Makes a GET request through the shared session, retrying transient
+    failures. Depending on HTTP_MODE, the response may be served from, or
+    saved to, the local response cache.
+
+    Args:
+        url (str): The url to request
+        params (dict): Query parameters for the request
+        max_retries (int): The number of times a failed request is retried
+        timeout (float): Seconds to wait for the server before giving up
+
+    Returns:
+        requests.Response: The last response received. Callers should still
+        check its status, since non-transient errors are not retried. Its
+        fetch_stats attribute holds the time taken, retries and time spent
+        backing off, for telemetry.
+    """
+    full_url = requests.Request('GET', url, params=params).prepare().url
+
+    if HTTP_MODE == 'replay':
+        response = load_cached(full_url)
+        if response is not None:
+            response.fetch_stats = {'cached': True, 'request_seconds': 0.0,
+                                    'retries': 0, 'backoff_seconds': 0.0}
+            return response
+
+    start = time.perf_counter()
+    response = fetch(full_url, max_retries, timeout)
+    response.fetch_stats['request_seconds'] = time.perf_counter() - start
+
+    if HTTP_MODE in ('record', 'replay'):
+        save_cached(full_url, response)
+
+    return response
+
+
+def fetch(url, max_retries=5, timeout=60):
+    """
+    Makes a GET request for a full url through the shared session, retrying
+    connection errors, 429 and 5xx responses.
+
+    Returns:
+        requests.Response: The last response received.
+    """
+    session = get_session()
+    backoff_seconds = 0.0
+
+    for attempt in range(max_retries + 1):
+        try:
+            response = session.get(url, timeout=timeout)
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == max_retries:
+                raise
+            delay = retry_delay(attempt)
+            backoff_seconds += delay
+            time.sleep(delay)
+            continue
+
+        if response.status_code not in RETRY_STATUSES \
+                or attempt == max_retries:
+            response.fetch_stats = {'cached': False, 'retries': attempt,
+                                    'backoff_seconds': backoff_seconds}
+            return response
+
+        delay = retry_delay(attempt, response)
+        backoff_seconds += delay
+        time.sleep(delay)
@@ -0,0 +1,41 @@
+"""
+A request rate governor shared by every worker making calls to an API.
+"""
+
+import threading
+import time
+
+
+class RateLimiter:
+    """
+    Spaces out requests so that, across all threads sharing the limiter,
+    no more than requests_per_second calls are started each second. The
+    total time callers spent waiting is kept in slept_seconds.
+    """
+
+    def __init__(self, requests_per_second):
+        """
+        Args:
+            requests_per_second (float): The request budget. None or 0
+                disables throttling.
+        """
+        if requests_per_second:
+            self.interval = 1 / requests_per_second
+        else:
+            self.interval = 0
+        self.next_slot = time.monotonic()
+        self.slept_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self):
+        """
+        Blocks until the caller is allowed to start its next request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_slot, now)
+            self.next_slot = slot + self.interval
+            self.slept_seconds += max(slot - now, 0)
+
+        if slot > now:
+            time.sleep(slot - now)
@@ -0,0 +1,304 @@
+"""
+A small local stand-in for the clinical trials and openFDA APIs, so the
+fetchers can be run end-to-end offline. It serves recorded raw data, or
+synthetic records, with the same pagination as the real APIs: the studies
+endpoint pages with an opaque nextPageToken, and the drugs endpoint pages
+with skip and limit, answers a 404 once skip runs past the results, and
+refuses to skip past MAX_SKIP results, as openFDA does.
+
+Point the fetchers at it with:
+    CLINICALTRIALS_TRIALS_API_URL=http://127.0.0.1:8000/api/v2/studies
+    CLINICALTRIALS_FDA_API_URL=http://127.0.0.1:8000/drug/drugsfda.json
+"""
+
+import argparse
+import gzip
+import json
+import pathlib
+import random
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+DATA_DIR = pathlib.Path(__file__).parent / '../../data'
+
+# The date filters the fetchers add to postFilter.advanced
+AREA_FILTER = re.compile(
+    r'AREA\[(StartDate|LastUpdatePostDate)\]'
+    r'(?:RANGE\[([^,\]]+),([^\]]+)\]|(MISSING))')
+
+# The submission date range the FDA fetcher searches on
+SUBMISSION_FILTER = re.compile(
+    r'submissions\.submission_status_date:?'
+    r'\[(\d{4}-\d{2}-\d{2}) TO (\d{4}-\d{2}-\d{2})\]')
+
+# openFDA answers a larger skip with a 400
+MAX_SKIP = 25000
+
+DATE_STRUCTS = {'StartDate': 'startDateStruct',
+                'LastUpdatePostDate': 'lastUpdatePostDateStruct'}
+
+DRUG_STEMS = ['acet', 'amlo', 'ator', 'bupr', 'cefa', 'dapa', 'empa', 'esom',
+              'fluo', 'gaba', 'insu', 'lisi', 'meto', 'metf', 'nalo', 'olan',
+              'pant', 'rosu', 'semi', 'sita', 'tira', 'vals', 'zole']
+DRUG_ENDINGS = ['mab', 'pril', 'statin', 'zole', 'formin', 'olol', 'sartan',
+                'gliptin', 'tide', 'pine', 'done', 'cillin']
+RACE_TITLES = ['White', 'Black or African American', 'Asian',
+               'American Indian or Alaska Native',
+               'Native Hawaiian or Other Pacific Islander',
+               'More than one race', 'Unknown or Not Reported']
+
+
+def make_synthetic_studies(count, seed=0):
+    """
+    Generates studies shaped like the clinical trials API response, with
+    every field the extractors read.
+
+    Args:
+        count (int): The number of studies to generate
+        seed (int): Seed for the random generator, so runs are repeatable
+
+    Returns:
+        list: One dict per study.
+    """
+    rng = random.Random(seed)
+    studies = []
+    for i in range(count):
+        start_year = rng.randint(1999, 2024)
+        drug = rng.choice(DRUG_STEMS) + rng.choice(DRUG_ENDINGS)
+        race_measurements = [
+            {'title': title,
+             'measurements': [{'groupId': 'BG000',
+                               'value': str(rng.randint(0, 500))}]}
+            for title in rng.sample(RACE_TITLES, 4)]
+        female, male = rng.randint(0, 500), rng.randint(0, 500)
+
+        studies.append({
+            'protocolSection': {
+                'identificationModule': {
+                    'nctId': f'NCT{i:08d}',
+                    'briefTitle': f'A Study of {drug.title()}',
+                    'officialTitle': f'A Phase 3 Study of {drug.title()}'},
+                'statusModule': {
+                    'overallStatus': rng.choice(['COMPLETED', 'TERMINATED']),
+                    'startDateStruct': {'date': f'{start_year}-01'},
+                    'primaryCompletionDateStruct':
+                        {'date': f'{start_year + 2}-06'},
+                    'lastUpdatePostDateStruct':
+                        {'date': f'{min(start_year + 3, 2024)}-02-01'}},
+                'sponsorCollaboratorsModule': {
+                    'leadSponsor': {'name': f'Sponsor {i % 50}'}},
+                'contactsLocationsModule': {
+                    'locations': [{'city': 'Chicago',
+                                   'country': 'United States'}]},
+                'armsInterventionsModule': {
+                    'interventions': [{'type': 'DRUG', 'name': drug},
+                                      {'type': 'DRUG', 'name': 'Placebo'}]},
+                'conditionsModule': {'conditions': ['Hypertension'],
+                                     'keywords': ['blood pressure']}},
+            'resultsSection': {
+                'baselineCharacteristicsModule': {'measures': [
+                    {'title': 'Race (NIH/OMB)',
+                     'paramType': 'COUNT_OF_PARTICIPANTS',
+                     'classes': [{'categories': race_measurements}]},
+                    {'title': 'Sex: Female, Male',
+                     'paramType': 'COUNT_OF_PARTICIPANTS',
+                     'classes': [{
+                         'denoms': [{'units': 'Participants', 'counts': [
+                             {'groupId': 'BG000',
+                              'value': str(female + male)}]}],
+                         'categories': [
+                             {'title': 'Female', 'measurements': [
+                                 {'groupId': 'BG000', 'value': str(female)}]},
+                             {'title': 'Male', 'measurements': [
+                                 {'groupId': 'BG000', 'value': str(male)}]}]
+                     }]}]}}})
+    return studies
+
+
+def make_synthetic_fda(count, seed=0):
+    """
+    Generates records shaped like the Drugs@FDA API response, with every
+    field the extractor reads.
+
+    Args:
+        count (int): The number of records to generate
+        seed (int): Seed for the random generator, so runs are repeatable
+
+    Returns:
+        list: One dict per application.
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(count):
+        brand = (rng.choice(DRUG_STEMS) + rng.choice(DRUG_ENDINGS)).upper()
+        generic = brand.lower() + ' hydrochloride'
+        records.append({
+            'application_number': f'NDA{i:06d}',
+            'sponsor_name': f'SPONSOR {i % 50}',
+            'submissions': [{'submission_status': 'AP',
+                             'submission_status_date':
+                                 f'{rng.randint(2003, 2024)}0101'}],
+            'products': [{'brand_name': brand}],
+            'openfda': {'brand_name': [brand],
+                        'generic_name': [generic.upper()],
+                        'substance_name': [generic.upper()],
+                        'manufacturer_name': [f'Manufacturer {i % 50}']}})
+    return records
+
+
+def load_raw(source):
+    """
+    Loads every record of a raw data file written by the fetchers.
+    """
+    with gzip.open(DATA_DIR / f"{source}.jsonl.gz", mode='rt') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def study_date(study, area):
+    """
+    Returns the date of a study used by a date filter, or None. Partial
+    dates such as 2010-05 are treated as the first day of the period.
+    """
+    date = study.get('protocolSection', {}).get('statusModule', {})\
+        .get(DATE_STRUCTS[area], {}).get('date')
+    if date:
+        date += '-01' * (2 - date.count('-'))
+    return date
+
+
+def filter_studies(studies, advanced):
+    """
+    Applies the StartDate and LastUpdatePostDate parts of a
+    postFilter.advanced expression. Other parts of the expression are
+    ignored, since the served data is already limited to matching studies.
+    """
+    for area, low, high, missing in AREA_FILTER.findall(advanced or ''):
+        if missing:
+            studies = [s for s in studies if not study_date(s, area)]
+            continue
+        studies = [s for s in studies if study_date(s, area)
+                   and (low == 'MIN' or study_date(s, area) >= low)
+                   and (high == 'MAX' or study_date(s, area) <= high)]
+    return studies
+
+
+def filter_fda(records, search):
+    """
+    Applies the submission date range of an openFDA search, keeping the
+    applications with a submission in the range. Searches without one are
+    not filtered.
+    """
+    match = SUBMISSION_FILTER.search(search or '')
+    if not match:
+        return records
+    low, high = (date.replace('-', '') for date in match.groups())
+    return [record for record in records
+            if any(low <= submission.get('submission_status_date', '') <= high
+                   for submission in record.get('submissions') or [])]
+
+
+def make_handler(studies, fda):
+    """
+    Builds a request handler class serving the given records.
+    """
+
+    class StandInHandler(BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0]
+                     for key, values in parse_qs(url.query).items()}
+
+            if url.path.endswith('/studies'):
+                self.send_studies(query)
+            elif url.path.endswith('drugsfda.json'):
+                self.send_fda(query)
+            else:
+                self.send_json(404, {'error': 'unknown endpoint'})
+
+        def send_studies(self, query):
+            matching = filter_studies(studies,
+                                      query.get('postFilter.advanced'))
+            offset = int(query.get('pageToken', 0))
+            size = int(query.get('pageSize', 10))
+            payload = {'studies': matching[offset:offset + size]}
+            if offset + size < len(matching):
+                payload['nextPageToken'] = str(offset + size)
+            self.send_json(200, payload)
+
+        def send_fda(self, query):
+            matching = filter_fda(fda, query.get('search'))
+            skip = int(query.get('skip', 0))
+            limit = int(query.get('limit', 1))
+            if skip > MAX_SKIP:
+                self.send_json(400, {'error': {
+                    'code': 'BAD_REQUEST',
+                    'message': f'Skip value must {MAX_SKIP} or less.'}})
+                return
+            if skip >= len(matching):
+                self.send_json(404, {'error': {'code': 'NOT_FOUND',
+                                               'message': 'No matches found!'}})
+                return
+            self.send_json(200, {
+                'meta': {'results': {'skip': skip, 'limit': limit,
+                                     'total': len(matching)}},
+                'results': matching[skip:skip + limit]})
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return StandInHandler
+
+
+def serve_in_background(studies, fda, port=0):
+    """
+    Starts the stand-in server on a background thread.
+
+    Args:
+        studies (list): The studies to serve
+        fda (list): The Drugs@FDA records to serve
+        port (int): The port to listen on. 0 picks a free port.
+
+    Returns:
+        tuple: The running server (call shutdown() to stop it) and its
+        base url.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port),
+                                 make_handler(studies, fda))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_port}'
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--from-raw', action='store_true',
+                        help='serve the raw data files in data/')
+    parser.add_argument('--trials', type=int, default=5000,
+                        help='number of synthetic studies to serve')
+    parser.add_argument('--fda', type=int, default=5000,
+                        help='number of synthetic FDA records to serve')
+    args = parser.parse_args()
+
+    if args.from_raw:
+        studies, fda = load_raw('trials'), load_raw('fda')
+    else:
+        studies = make_synthetic_studies(args.trials)
+        fda = make_synthetic_fda(args.fda)
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port),
+                                 make_handler(studies, fda))
+    print(f"Serving {len(studies)} studies and {len(fda)} FDA records on "
+          f"http://127.0.0.1:{args.port}")
+    server.serve_forever()
@@ -0,0 +1,122 @@
+"""
+Per-request metrics for the API fetchers. Each page fetched is logged as
+one JSON line to data/metrics/<source>_fetch.jsonl, and an end-of-run
+summary of throughput, and of the time spent transferring, decoding,
+backing off and sleeping, is printed and saved alongside it.
+"""
+
+import json
+import pathlib
+import threading
+import time
+
+METRICS_DIR = pathlib.Path(__file__).parent / '../../data/metrics'
+
+
+class FetchMetrics:
+    """
+    Collects metrics for one pull. Safe to share between worker threads.
+    """
+
+    def __init__(self, source):
+        """
+        Args:
+            source (str): The name of the pull, used to name the metrics files
+        """
+        self.source = source
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.totals = {'pages': 0, 'records': 0, 'bytes': 0, 'wire_bytes': 0,
+                       'cached_pages': 0, 'retries': 0,
+                       'request_seconds': 0.0, 'backoff_seconds': 0.0,
+                       'decode_seconds': 0.0}
+
+        METRICS_DIR.mkdir(parents=True, exist_ok=True)
+        self.log_path = METRICS_DIR / f"{source}_fetch.jsonl"
+        open(self.log_path, mode='w').close()
+
+    def record_page(self, response, decode_seconds, records):
+        """
+        Logs the metrics for one fetched page.
+
+        Args:
+            response (requests.Response): A response from http_client.get
+            decode_seconds (float): Time spent decoding the JSON body
+            records (int): The number of records on the page
+        """
+        stats = getattr(response, 'fetch_stats', {})
+        size = len(response.content)
+        metric = {
+            'time': time.time(),
+            'url': response.url,
+            'status': response.status_code,
+            'request_seconds': stats.get('request_seconds', 0.0),
+            'backoff_seconds': stats.get('backoff_seconds', 0.0),
+            'retries': stats.get('retries', 0),
+            'cached': stats.get('cached', False),
+            'bytes': size,
+            'wire_bytes': int(response.headers.get('Content-Length', size)),
+            'decode_seconds': decode_seconds,
+            'records': records,
+        }
+
+        with self.lock:
+            totals = self.totals
+            totals['pages'] += 1
+            totals['cached_pages'] += metric['cached']
+            for key in ('records', 'bytes', 'wire_bytes', 'retries',
+                        'request_seconds', 'backoff_seconds',
+                        'decode_seconds'):
+                totals[key] += metric[key]
+            with open(self.log_path, mode='a') as f:
+                f.write(json.dumps(metric) + '\n')
+
+    def summary(self, sleep_seconds=0.0):
+        """
+        Summarizes the pull so far.
+
+        Args:
+            sleep_seconds (float): Time workers spent waiting on the rate
+                limiter
+
+        Returns:
+            dict: Totals, throughput and time budget for the pull. Time
+            totals are summed over workers, so with concurrent workers they
+            can exceed the wall time.
+        """
+        with self.lock:
+            summary = dict(self.totals)
+        wall = time.perf_counter() - self.started
+
+        summary['source'] = self.source
+        summary['wall_seconds'] = wall
+        summary['sleep_seconds'] = sleep_seconds
+        summary['transfer_seconds'] = \
+            summary['request_seconds'] - summary['backoff_seconds']
+        summary['records_per_second'] = summary['records'] / wall \
+            if wall else 0.0
+        summary['megabytes_per_second'] = summary['bytes'] / 1e6 / wall \
+            if wall else 0.0
+        return summary
+
+    def write_summary(self, sleep_seconds=0.0):
+        """
+        Prints the end-of-run summary and saves it to
+        data/metrics/<source>_fetch_summary.json.
+        """
+        summary = self.summary(sleep_seconds)
+        with open(METRICS_DIR / f"{self.source}_fetch_summary.json",
+                  mode='w') as f:
+            json.dump(summary, f, indent=2)
+
+        print(f"{self.source}: {summary['records']} records in "
+              f"{summary['pages']} pages ({summary['cached_pages']} cached), "
+              f"{summary['bytes'] / 1e6:.1f} MB, "
+              f"{summary['wall_seconds']:.1f}s wall, "
+              f"{summary['records_per_second']:.0f} records/s")
+        print(f"{self.source}: {summary['transfer_seconds']:.1f}s "
+              f"transferring, {summary['decode_seconds']:.1f}s decoding, "
+              f"{summary['backoff_seconds']:.1f}s backing off over "
+              f"{summary['retries']} retries, "
+              f"{summary['sleep_seconds']:.1f}s rate limited")
+        return summary
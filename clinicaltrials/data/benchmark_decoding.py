@@ -0,0 +1,90 @@
+"""
+Benchmarks the decoding backends in study_decoder against each other on
+the raw trials data, both for decoding alone and for decoding followed by
+extraction of every table, and checks that they extract identical tables.
+
+Run: python3 clinicaltrials/data/benchmark_decoding.py
+"""
+
+import argparse
+import time
+from collapse_race_data import RaceRecoder
+from extract_trials_data import extract_tables
+from raw_store import iter_lines, raw_path
+from study_decoder import get_decoder, msgspec
+
+
+def time_backend(lines, backend, repeat):
+    """
+    Times one decoding backend over the given lines.
+
+    Args:
+        -- lines (list): Undecoded JSON lines, one per study
+        -- backend (str): The decoding backend
+        -- repeat (int): The number of runs; the fastest is reported
+
+    Returns:
+        -- tuple: Best seconds to decode, best seconds to decode and extract,
+            and the extracted tables.
+    """
+    decode = get_decoder(backend)
+    decode_seconds = []
+    extract_seconds = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            decode(line)
+        decode_seconds.append(time.perf_counter() - start)
+
+        recoder = RaceRecoder(cache_path=None)
+        start = time.perf_counter()
+        tables, _ = extract_tables(lines, recoder, backend)
+        extract_seconds.append(time.perf_counter() - start)
+
+    return min(decode_seconds), min(extract_seconds), tables
+
+
+def run_benchmark(filepath, repeat=3):
+    """
+    Benchmarks every available backend on a raw trials file and prints the
+    results.
+    """
+    lines = list(iter_lines(filepath))
+    size = sum(len(line) for line in lines)
+    print(f"{len(lines)} studies, {size / 1e6:.1f} MB of JSON, "
+          f"best of {repeat} runs")
+
+    backends = ["stdlib"] if msgspec is None else ["stdlib", "msgspec"]
+    if msgspec is None:
+        print("msgspec is not installed, only the stdlib backend is timed")
+
+    results = {}
+    for backend in backends:
+        decode_time, extract_time, tables = time_backend(lines, backend,
+                                                         repeat)
+        results[backend] = (decode_time, extract_time, tables)
+        print(f"{backend:>8}: decode {decode_time:.2f}s "
+              f"({len(lines) / decode_time:,.0f} studies/s), "
+              f"decode + extract {extract_time:.2f}s "
+              f"({len(lines) / extract_time:,.0f} studies/s)")
+
+    if "msgspec" in results:
+        base_decode, base_extract, base_tables = results["stdlib"]
+        decode_time, extract_time, tables = results["msgspec"]
+        print(f"msgspec speedup: decode {base_decode / decode_time:.1f}x, "
+              f"decode + extract {base_extract / extract_time:.1f}x")
+        if any(not tables[name].to_frame().equals(table.to_frame())
+               for name, table in base_tables.items()):
+            raise AssertionError("msgspec and stdlib extracted different "
+                                 "tables")
+        print("Extracted tables are identical.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    run_benchmark(raw_path("trials"), repeat=args.repeat)
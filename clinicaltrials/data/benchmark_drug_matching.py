@@ -0,0 +1,387 @@
+"""
+Benchmarks matching intervention names to canonical drugs, and clustering
+new FDA brand names into canonical drugs, on synthetic data whose right
+answers are known. Catalogues of made up drug names are generated at each
+scale, along with intervention names that spell them with salt forms,
+doses, dosage forms, different case or typos, and placebos and drugs
+missing from the catalogue, which should match nothing.
+
+For each scale and tolerance, get_probable_matches is timed, and its
+precision and recall are measured. Pairs are the candidate pairs of an
+intervention and a canonical drug sent to the scorer. Incremental
+create_canonical_drugs is timed on a catalogue clustered before, with new
+brand names that are either variants of drugs in it or new drugs. Every
+run is made in a fresh process, so that its peak memory is its own.
+
+Run: python3 clinicaltrials/data/benchmark_drug_matching.py
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing
+import pathlib
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pandas as pd
+from collapse_drug_data import canonical_keys, create_canonical_drugs, \
+    get_probable_matches
+from drug_clusters import DrugClusters, block_keys, clean_brand_name
+from drug_index import TrigramIndex
+from drug_names import drug_key
+from drug_scoring import EPSILON, score_bounds
+
+SYLLABLES = (
+    "ab", "ac", "al", "am", "an", "ar", "as", "az", "be", "bi", "bo", "ca",
+    "ce", "ci", "co", "da", "de", "di", "do", "du", "e", "fa", "fe", "fi",
+    "flu", "ga", "ge", "gli", "ha", "hy", "i", "ka", "la", "le", "li", "lo",
+    "ma", "me", "mi", "mo", "na", "ne", "ni", "no", "o", "pa", "pe", "pi",
+    "pra", "pro", "ra", "re", "ri", "ro", "sa", "se", "si", "so", "ta", "te",
+    "ti", "to", "tra", "u", "va", "ve", "vi", "xa", "za", "zo",
+)
+
+STEMS = (
+    "azepam", "cillin", "done", "fen", "formin", "lukast", "mab", "mycin",
+    "nib", "olol", "oxetine", "parin", "pine", "pril", "sartan", "statin",
+    "tide", "tinib", "vir", "zole",
+)
+
+SALTS = ("hydrochloride", "sodium", "mesylate", "sulfate", "hcl")
+DOSES = ("5 mg", "10mg", "250 mg", "0.5 mg/kg", "40 units/ml", "1%")
+FORMS = ("tablets", "capsules", "injection", "oral solution")
+
+TOLERANCES = (0.8, 0.85, 0.9, 0.95)
+
+
+def make_name(rng):
+    """
+    Makes up a drug name from a few syllables and a drug stem.
+    """
+    syllables = rng.choices(SYLLABLES, k=rng.randint(1, 3))
+    return "".join(syllables) + rng.choice(STEMS)
+
+
+def make_catalogue(size, rng):
+    """
+    Makes up a catalogue of distinct drug names.
+
+    Args:
+        -- size (int): The number of drugs
+        -- rng (Random): The random number generator
+
+    Returns:
+        -- list: The lowercased drug names.
+    """
+    names = {}
+    while len(names) < size:
+        names[make_name(rng)] = None
+    return list(names)
+
+
+def misspell(name, rng):
+    """
+    Makes one typo in a name, by replacing, dropping, adding or swapping
+    letters.
+    """
+    i = rng.randrange(len(name))
+    letter = rng.choice("abcdefghijklmnopqrstuvwxyz")
+    kind = rng.randrange(4)
+    if kind == 0:
+        return name[:i] + letter + name[i + 1:]
+    if kind == 1 and len(name) > 3:
+        return name[:i] + name[i + 1:]
+    if kind == 2 or i == len(name) - 1:
+        return name[:i] + letter + name[i:]
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+
+def make_interventions(catalogue, size, rng):
+    """
+    Makes up intervention names for the drugs of a catalogue.
+
+    Args:
+        -- catalogue (list): The drug names
+        -- size (int): The number of interventions
+        -- rng (Random): The random number generator
+
+    Returns:
+        -- tuple: The intervention names, and for each, the position in the
+            catalogue of the drug it names, or None if it names none.
+    """
+    known = set(catalogue)
+    names = []
+    truths = []
+    for _ in range(size):
+        drug = rng.randrange(len(catalogue))
+        name = catalogue[drug]
+        kind = rng.random()
+        if kind < 0.2:
+            names.append(rng.choice(("Placebo", f"Matching placebo for "
+                                                f"{name.title()}")))
+            drug = None
+        elif kind < 0.3:
+            name = make_name(rng)
+            while name in known:
+                name = make_name(rng)
+            names.append(name.title())
+            drug = None
+        elif kind < 0.55:
+            names.append(f"{name.title()} {rng.choice(SALTS)} "
+                         f"{rng.choice(DOSES)}")
+        elif kind < 0.7:
+            names.append(f"{name.upper()} {rng.choice(FORMS)}")
+        elif kind < 0.8:
+            names.append(name.title())
+        else:
+            names.append(misspell(name, rng))
+        truths.append(drug)
+    return names, truths
+
+
+def count_pairs(canonical_data, names, tolerances, scorer="jaro"):
+    """
+    Counts the candidate pairs get_probable_matches sends to the scorer at
+    each tolerance, given no saved matches.
+
+    Returns:
+        -- dict: The number of pairs at each tolerance.
+    """
+    _, key_names = canonical_keys(canonical_data)
+    index = TrigramIndex(key_names)
+    keys = {drug_key(name.lower()) for name in names}
+    pairs = dict.fromkeys(tolerances, 0)
+    for key in keys:
+        if not key or key in key_names:
+            continue
+        ids = index.candidate_ids(key)
+        bounds = score_bounds(key, index.lengths[ids],
+                              index.char_counts[ids], scorer)
+        for tolerance in tolerances:
+            pairs[tolerance] += int((bounds >= tolerance - EPSILON).sum())
+    return pairs
+
+
+def peak_memory():
+    """
+    Returns the peak resident memory of this process and its children, in
+    MB.
+    """
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux reports kilobytes
+    return peak / 1024
+
+
+def time_matching(size, interventions, tolerance, processes, seed):
+    """
+    Times get_probable_matches on a synthetic catalogue and interventions,
+    and measures how many of its matches are right.
+
+    Args:
+        -- size (int): The number of drugs in the catalogue
+        -- interventions (int): The number of interventions
+        -- tolerance (float): The least similarity score of a match
+        -- processes (int): The number of worker processes
+        -- seed (int): The random seed
+
+    Returns:
+        -- dict: Seconds, peak memory, precision and recall.
+    """
+    rng = random.Random(seed)
+    catalogue = make_catalogue(size, rng)
+    names, truths = make_interventions(catalogue, interventions, rng)
+
+    # Each drug is listed with a brand name and a generic name, as in the
+    # FDA data
+    canonical_data = pd.Series([name.upper() for name in catalogue]
+                               + [f"{name.upper()} HYDROCHLORIDE"
+                                  for name in catalogue])
+    drug_ids = {name.lower(): drug % size
+                for drug, name in enumerate(canonical_data)}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = pathlib.Path(tmp) / "trial_interventions_raw.csv"
+        pd.DataFrame({"nct_id": "NCT00000000",
+                      "intervention_name": names}).to_csv(filename,
+                                                          index=False)
+        memory = peak_memory()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            matches = get_probable_matches(canonical_data, filename,
+                                           tolerance=tolerance,
+                                           processes=processes,
+                                           cache_path=None)
+        seconds = time.perf_counter() - start
+
+    right = 0
+    wrong = 0
+    for name, truth in zip(names, truths):
+        match = matches.get(name.lower())
+        if match is None:
+            continue
+        if drug_ids[match] == truth:
+            right += 1
+        else:
+            wrong += 1
+    return {"seconds": seconds, "start_memory": memory,
+            "peak_memory": peak_memory(),
+            "precision": right / max(right + wrong, 1),
+            "recall": right / sum(truth is not None for truth in truths)}
+
+
+def time_clustering(size, new_names, seed):
+    """
+    Times incremental create_canonical_drugs on a synthetic catalogue whose
+    drugs were each clustered before, with new brand names that are half
+    variants of drugs in the catalogue and half new drugs, and measures how
+    many are clustered right.
+
+    Args:
+        -- size (int): The number of drugs in the catalogue
+        -- new_names (int): The number of new brand names
+        -- seed (int): The random seed
+
+    Returns:
+        -- dict: Seconds, comparisons, peak memory, precision and recall.
+    """
+    rng = random.Random(seed)
+    catalogue = make_catalogue(size, rng)
+    known = set(catalogue)
+    names = []
+    truths = []
+    for _ in range(new_names):
+        if rng.random() < 0.5:
+            drug = rng.randrange(size)
+            name = misspell(catalogue[drug], rng)
+            if rng.random() < 0.5:
+                name = f"{name} {rng.choice(('xr', 'er', 'pen', 'kit'))}"
+            if name in known:
+                continue
+        else:
+            drug = None
+            name = make_name(rng)
+            if name in known:
+                continue
+        known.add(name)
+        names.append(name.upper())
+        truths.append(drug)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = pathlib.Path(tmp)
+        clusters = DrugClusters(tmp / "drug_clusters.json")
+        for name in catalogue:
+            clusters.new_cluster(name)
+        clusters.save()
+
+        # Replay the clustering to count the representatives each new name
+        # is compared with
+        replay = DrugClusters(tmp / "drug_clusters.json")
+        comparisons = 0
+        for name in names:
+            name = clean_brand_name(name)
+            comparisons += len({cluster_id for key in block_keys(name)
+                                for cluster_id in replay.blocks.get(key, ())})
+            replay.assign(name)
+
+        fda_filename = tmp / "fda_full.csv"
+        pd.DataFrame({"brand_name": [name.upper() for name in catalogue]
+                      + names}).to_csv(fda_filename, index=False)
+        memory = peak_memory()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            create_canonical_drugs(fda_filename,
+                                   canonical_filename=tmp / "canonical.csv",
+                                   state_path=tmp / "drug_clusters.json")
+        seconds = time.perf_counter() - start
+        clusters = DrugClusters(tmp / "drug_clusters.json")
+
+    right = 0
+    joined = 0
+    for name, truth in zip(names, truths):
+        cluster_id = clusters.clusters[clean_brand_name(name)]
+        if cluster_id < size:
+            joined += 1
+            right += cluster_id == truth
+    return {"seconds": seconds, "comparisons": comparisons,
+            "names": len(names), "start_memory": memory,
+            "peak_memory": peak_memory(),
+            "precision": right / max(joined, 1),
+            "recall": right / sum(truth is not None for truth in truths)}
+
+
+def in_fresh_process(function, *args):
+    """
+    Runs a function in a new process, and returns its result.
+    """
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+        return executor.submit(function, *args).result()
+
+
+def run_benchmark(scales, tolerances=TOLERANCES, ratio=1.0, processes=1,
+                  seed=0):
+    """
+    Benchmarks matching and clustering at every scale and prints the
+    results.
+
+    Args:
+        -- scales (list): Catalogue sizes
+        -- tolerances (list): The tolerances to match at
+        -- ratio (float): The number of interventions per catalogue drug
+        -- processes (int): The number of matching worker processes
+        -- seed (int): The random seed
+    """
+    for size in scales:
+        interventions = max(int(size * ratio), 1)
+        rng = random.Random(seed)
+        catalogue = make_catalogue(size, rng)
+        names, _ = make_interventions(catalogue, interventions, rng)
+        canonical_data = [name.upper() for name in catalogue] + \
+            [f"{name.upper()} HYDROCHLORIDE" for name in catalogue]
+        pairs = count_pairs(canonical_data, names, tolerances)
+
+        print(f"{size:,} drugs, {interventions:,} interventions")
+        for tolerance in tolerances:
+            result = in_fresh_process(time_matching, size, interventions,
+                                      tolerance, processes, seed)
+            seconds = result["seconds"]
+            print(f"  match at {tolerance:.2f}: {seconds:.2f}s, "
+                  f"{pairs[tolerance]:,} pairs "
+                  f"({pairs[tolerance] / seconds:,.0f} pairs/s), "
+                  f"{interventions / seconds:,.0f} interventions/s, "
+                  f"peak {result['peak_memory']:,.0f} MB "
+                  f"({result['start_memory']:,.0f} MB before), "
+                  f"precision {result['precision']:.3f}, "
+                  f"recall {result['recall']:.3f}")
+
+        result = in_fresh_process(time_clustering, size,
+                                  max(size // 10, 1), seed)
+        seconds = result["seconds"]
+        print(f"  cluster {result['names']:,} new brand names: "
+              f"{seconds:.2f}s, {result['comparisons']:,} comparisons "
+              f"({result['comparisons'] / seconds:,.0f} comparisons/s), "
+              f"peak {result['peak_memory']:,.0f} MB "
+              f"({result['start_memory']:,.0f} MB before), "
+              f"precision {result['precision']:.3f}, "
+              f"recall {result['recall']:.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+",
+                        default=[1000, 10000, 100000],
+                        help="catalogue sizes, up to 1000000")
+    parser.add_argument("--tolerances", type=float, nargs="+",
+                        default=TOLERANCES)
+    parser.add_argument("--ratio", type=float, default=1.0,
+                        help="interventions per catalogue drug")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    run_benchmark(args.scales, args.tolerances, args.ratio, args.processes,
+                  args.seed)
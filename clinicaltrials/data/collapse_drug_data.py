@@ -6,64 +6,207 @@ in the clinical trials using jaro-winkler similarity.
 Written by Caitlin Pratt
 """
 
-import jellyfish
+import argparse
 import pandas_dedupe
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
 import pandas as pd
-
-def create_canonical_drugs(fda_filename):
+from drug_clusters import CLUSTER_STATE, DrugClusters, clean_brand_name
+from drug_index import TrigramIndex
+from drug_names import drug_key
+from drug_scoring import EPSILON, MATCHER_VERSION, match_block, \
+    score_bounds
+from match_cache import MATCH_CACHE, MatchCache, matcher_fingerprint
+from table_store import FORMATS, read_table, table_path, write_table
+
+CANONICAL_DRUGS = pathlib.Path(__file__).parent / \
+    "../../data/csvs/canonical_drugs.csv"
+
+def create_canonical_drugs(fda_filename, full=False,
+                           canonical_filename=CANONICAL_DRUGS,
+                           state_path=CLUSTER_STATE):
     """
     Creates a canonical list of drugs from the fda data using fuzzy deduping.
+    The clusters found are saved, and on later runs only brand names not
+    seen before are clustered, each against the representatives of the
+    existing clusters sharing a block key with it.
 
     Args:
     -- fda_filename (str): Filepath to a csv containing fda drug data returned
     from the fda api
+    -- full (bool): Whether to dedupe the whole table again, discarding the
+    saved clusters
+    -- canonical_filename (str): The path the canonical drugs are saved to
+    -- state_path (str): The file clusters are saved to between runs
 
     Returns:
     None. Saves a csv of FDA drug records deduped on brand name.
 
     """
-    fda = pd.read_csv(fda_filename)
+    fda = read_table(fda_filename)
+    names = fda['brand_name'].dropna().map(clean_brand_name)
+
+    clusters = DrugClusters(state_path)
+    if full or not clusters:
+        fda['brand_name'] = fda['brand_name'].str.lower()
+        fda_deduped = pandas_dedupe.dedupe_dataframe(fda, ['brand_name'])
+        clusters.add_dedupe_clusters(
+            names, fda_deduped.loc[names.index, 'cluster id'])
+    else:
+        new_names = [name for name in names.unique()
+                     if name not in clusters.clusters]
+        print(f"Clustering {len(new_names)} new brand names")
+        for name in new_names:
+            clusters.assign(name)
+    clusters.save()
+
+    fda_canonical = pd.DataFrame({'brand_name': clusters.representatives})
+    fda_canonical.to_csv(canonical_filename, columns=['brand_name'],
+                         index=False)
 
-    fda['brand_name'] = fda['brand_name'].str.lower()
-    fda_deduped = pandas_dedupe.dedupe_dataframe(fda, ['brand_name'])
-    fda_canonical = fda_deduped.drop_duplicates(subset=['brand_name'])
 
-    filename = pathlib.Path(__file__).parent / \
-        f"../../data/csvs/canonical_drugs.csv"
-    fda_canonical.to_csv(filename, columns=['brand_name'],
-                         index=False)
+def canonical_keys(canonical_data):
+    """
+    Keys the canonical drug names with drug_key.
+
+    Args:
+    -- canonical drugs (series): Canonical drug names
+
+    Returns:
+    Tuple of the distinct lowercased canonical names, in order, and a dict
+    from each key to the first of them that has it.
+    """
+    canonical = list(dict.fromkeys(
+        str(name).lower() for name in canonical_data
+        if isinstance(name, str) and name))
+    key_names = {}
+    for name in canonical:
+        key_names.setdefault(drug_key(name), name)
+    key_names.pop('', None)
+    return canonical, key_names
+
+
+def make_blocks(index, names, block_size, tolerance, scorer='jaro'):
+    """
+    Splits intervention names into blocks, and looks up the candidate
+    canonical names of each. Candidates whose score is bound to fall short
+    of the tolerance are dropped here, so they are never sent to be scored.
 
+    Args:
+    -- index (TrigramIndex): The index of canonical names
+    -- names (list): Lowercased intervention names
+    -- block_size (int): The number of intervention names in each block
+    -- tolerance (float): The least similarity score of a match
+    -- scorer (str): 'jaro' or 'jaro_winkler'
 
-def get_probable_matches(canonical_data, raw_trials_filename, tolerance=.85):
+    Returns:
+        Generator of (queries, candidates, bounds) tuples, as taken by
+        match_block.
+    """
+    for start in range(0, len(names), block_size):
+        queries = names[start:start + block_size]
+        candidates = []
+        bounds = []
+        for query in queries:
+            ids = index.candidate_ids(query)
+            query_bounds = score_bounds(query, index.lengths[ids],
+                                        index.char_counts[ids], scorer)
+            keep = query_bounds >= tolerance - EPSILON
+            candidates.append(index.name_array[ids[keep]])
+            bounds.append(query_bounds[keep])
+        yield queries, candidates, bounds
+
+
+def get_probable_matches(canonical_data, raw_trials_filename, tolerance=.85,
+                         scorer='jaro', processes=1, block_size=500,
+                         top_k=None, cache_path=MATCH_CACHE):
     """
     Loads a csv of fda data containing drug names, and clincal trials data
     containing intervention names, and attempts to fuzzy match them
-    using the jaro-winkler similarity score.
+    using the jaro-winkler similarity score. Names are first normalized with
+    drug_key, and interventions whose key is the key of a canonical drug are
+    matched to it exactly, with a score of 1, while placebos match nothing.
+    Only the keys of the other interventions are fuzzy matched, against the
+    keys of the canonical drugs. Each intervention is matched to
+    its best scoring canonical drug, with ties going to the drug listed
+    first. Drugs that cannot beat the tolerance, or the best match found,
+    are never scored. Names are scored in blocks, and with more than one
+    process the blocks are scored in parallel. Matches are saved, and only
+    names not matched by an earlier run with the same canonical drugs and
+    settings are scored.
 
     Args:
-    -- canonical drugs (dataframe): A deduped pandas dataframe canonical drugs
+    -- canonical drugs (series): Canonical drug names, e.g. brand and generic
+    names from the deduped FDA data
     -- interventions_filename (str): The path to the file of clinical trials
     data to be recoded
-    """
-    raw = pd.read_csv(raw_trials_filename)
+    -- tolerance (float): The least similarity score of a match
+    -- scorer (str): 'jaro' or 'jaro_winkler'
+    -- processes (int): The number of worker processes
+    -- block_size (int): The number of intervention names in each block
+    -- top_k (int): If given, the number of best matches kept for each
+    intervention, as (canonical name, score) tuples, best first
+    -- cache_path (str): The file matches are saved to between runs. None
+    disables it.
 
-    raw_unique = raw['intervention_name'].str.lower().unique()
+    Returns:
+    Dict of the best match of each intervention that has one, or of its top
+    matches if top_k is given.
+    """
+    raw = read_table(raw_trials_filename)
+
+    raw_unique = list(raw['intervention_name'].dropna().str.lower().unique())
+
+    # Names are joined on their keys first
+    canonical, key_names = canonical_keys(canonical_data)
+    raw_keys = {name: drug_key(name) for name in raw_unique}
+    residue = list(dict.fromkeys(key for key in raw_keys.values()
+                                 if key and key not in key_names))
+    print(f"{sum(key in key_names for key in raw_keys.values())} of "
+          f"{len(raw_unique)} intervention names matched exactly")
+
+    # Only canonical drugs sharing enough trigrams with an intervention are
+    # scored, instead of every drug with the same first letter
+    index = TrigramIndex(key_names)
+
+    # Matches are kept with their scores, whatever is returned
+    k = top_k or 1
+    cache = MatchCache(matcher_fingerprint(canonical, {
+        'version': MATCHER_VERSION, 'tolerance': tolerance,
+        'scorer': scorer, 'top_k': k,
+        'min_similarity': index.min_similarity}), cache_path)
+    unmatched = cache.missing(residue)
+    print(f"{len(unmatched)} of {len(residue)} other intervention names were "
+          f"not matched before")
+    blocks = make_blocks(index, unmatched, block_size, tolerance, scorer)
 
     recoded = {}
-    for raw_entry in raw_unique:
-        for canon_entry in canonical_data:
-            # Block on the first letter to speed up computation
-            if raw_entry.startswith(canon_entry[0]):
-                sim_score = jellyfish.jaro_similarity(canon_entry, raw_entry)
-                if sim_score >= tolerance:
-                    recoded[raw_entry] = canon_entry
-                    break
-
-    return recoded
-
-
-def recode_trial_drugs(canonical_filename, raw_filename):
+    if processes == 1:
+        for block in blocks:
+            recoded.update(match_block(*block, tolerance, scorer, k))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(match_block, *block, tolerance, scorer,
+                                       k)
+                       for block in blocks]
+            for future in futures:
+                recoded.update(future.result())
+    cache.update(unmatched, recoded)
+    cache.save()
+
+    matches = {}
+    for name, key in raw_keys.items():
+        if key in key_names:
+            matches[name] = [(key_names[key], 1.0)]
+        elif key and cache.matches[key]:
+            matches[name] = [(key_names[match], score)
+                             for match, score in cache.matches[key]]
+    if top_k:
+        return matches
+    return {name: ranked[0][0] for name, ranked in matches.items()}
+
+
+def recode_trial_drugs(canonical_filename, raw_filename, processes=1):
     """
     Recodes drug names returned by the clinical trials API to match
     their canonical names in the FDA dataset.
@@ -73,19 +216,39 @@ def recode_trial_drugs(canonical_filename, raw_filename):
         Should be generated using the create_canonical_drugs function.
     -- interventions_filename (str): The path to the file of clinical trials
     data to be recoded
+    -- processes (int): The number of worker processes used to match names
 
     Returns:
-    None. Writes a csv to the csvs folder for uploading to the database.
+    None. Writes a table to the csvs folder for uploading to the database,
+    in the same format as the raw interventions table.
     """
-    drugs = pd.read_csv(canonical_filename)['brand_name']
-    probable_matches = get_probable_matches(drugs, raw_filename)
-    trial_interventions = pd.read_csv(raw_filename)
-    trial_interventions['intervention_name'] = trial_interventions['intervention_name'].str.lower()
-    trial_interventions['intervention_name'].replace(probable_matches)
+    canonical = read_table(canonical_filename)
+    # Interventions may be named by either brand or generic name
+    drugs = pd.concat([canonical[column] for column in
+                       ('brand_name', 'generic_name') if column in canonical])
+    probable_matches = get_probable_matches(drugs, raw_filename,
+                                            processes=processes)
+    trial_interventions = read_table(raw_filename)
+    names = trial_interventions['intervention_name'].str.lower()
+    # Names without a match are kept as they are
+    trial_interventions['intervention_name'] = \
+        names.map(probable_matches).fillna(names)
 
     # Recoding introduces duplicates
     trials = trial_interventions.drop_duplicates()
 
-    filename = pathlib.Path(__file__).parent / \
-        f"../../data/csvs/trial_interventions.csv"
-    trials.to_csv(filename, index=None)
+    fmt = pathlib.Path(raw_filename).suffix.lstrip('.')
+    write_table(trials, table_path('trial_interventions', fmt))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--format", choices=FORMATS, default="csv",
+                        help="format of the extracted FDA table")
+    parser.add_argument("--full", action="store_true",
+                        help="dedupe every brand name again instead of "
+                             "clustering only new ones")
+    args = parser.parse_args()
+
+    create_canonical_drugs(table_path("fda_full", args.format),
+                           full=args.full)
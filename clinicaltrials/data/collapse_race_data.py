@@ -5,8 +5,12 @@ a set of standardized categories.
 Written by Caitlin Pratt
 """
 
-import re
+import hashlib
 import json
+import os
+import pathlib
+import re
+from raw_store import iter_records
 
 WHITE = 'white'
 BLACK = 'black'
@@ -18,20 +22,130 @@ NOT_LATINO = 'not_hispanic_or_latino'
 MUL = 'multiple'
 UNK = 'unknown'
 
+# Keywords for each standardized category, in order of precedence. A
+# category title is given the code of the first pattern found anywhere in it.
+RACE_PATTERNS = [
+    (MUL, 'multiple|more than one|multi'),
+    (WHITE, 'white|caucasian'),
+    (ASIAN, 'asian'),
+    (BLACK, 'black|african'),
+    (HI_PI, 'hawaiian'),
+    (LATINO, 'latin|hispanic|mexican'),
+    (NOT_LATINO, 'not latin'),
+    (AI_AN, 'american indian|alaska|native'),
+    (UNK, 'other|unknown|refused|not applicable|none|declined|chose not|'
+          'no response|missing|prefer not|not report'),
+    (MUL, 'multiple|more than one|multi|mixed'),
+]
+
+RECODING_CACHE = pathlib.Path(__file__).parent / \
+    "../../data/race_recoding.json"
+
+
+class RaceRecoder:
+    """
+    Recodes race category titles to standardized categories. All keyword
+    patterns are compiled into one expression, so each title is scanned
+    once, and every title classified is remembered, including across runs
+    through a cache file.
+    """
+
+    def __init__(self, cache_path=RECODING_CACHE):
+        """
+        Args:
+        -- cache_path (str): The file classified titles are saved to. None
+            disables the cache file.
+        """
+        # Each alternative sits in a lookahead, so matching is attempted at
+        # every position and overlapping keywords are all seen
+        alternatives = '|'.join(f'(?P<p{i}>{pattern})'
+                                for i, (_, pattern) in enumerate(RACE_PATTERNS))
+        self.pattern = re.compile(f'(?=(?:{alternatives}))', re.IGNORECASE)
+        self.fingerprint = hashlib.sha1(
+            json.dumps(RACE_PATTERNS).encode('utf-8')).hexdigest()
+
+        self.cache_path = cache_path
+        self.codes = {}
+        self.new_codes = {}
+        if cache_path and pathlib.Path(cache_path).exists():
+            with open(cache_path) as f:
+                cached = json.load(f)
+            # Titles classified with different patterns must be redone
+            if cached.get('fingerprint') == self.fingerprint:
+                self.codes = cached['codes']
+
+    def classify(self, category):
+        """
+        Classifies one category title, without using the cache.
+
+        Returns:
+            str: The standardized category, or None if no keyword matched.
+        """
+        best = None
+        for match in self.pattern.finditer(str(category)):
+            precedence = int(match.lastgroup[1:])
+            if best is None or precedence < best:
+                best = precedence
+                if best == 0:
+                    break
+
+        if best is None:
+            return None
+        return RACE_PATTERNS[best][0]
+
+    def code(self, category):
+        """
+        Returns the standardized category of a title, classifying it only
+        the first time it is seen.
+
+        Returns:
+            str: The standardized category, or None if no keyword matched.
+        """
+        key = str(category)
+        if key not in self.codes:
+            self.codes[key] = self.new_codes[key] = self.classify(category)
+        return self.codes[key]
+
+    def update(self, new_codes):
+        """
+        Adds titles classified by another recoder, e.g. a copy of this one
+        used in a worker process.
+        """
+        for key, code in new_codes.items():
+            if key not in self.codes:
+                self.codes[key] = self.new_codes[key] = code
+
+    def save(self):
+        """
+        Atomically saves the classified titles to the cache file, if any are
+        new, so an interrupted run never leaves a corrupt cache behind.
+        """
+        if not self.cache_path or not self.new_codes:
+            return
+        pth = pathlib.Path(self.cache_path)
+        tmp_pth = pth.with_name(pth.name + '.tmp')
+        with open(tmp_pth, mode='w') as f:
+            json.dump({'fingerprint': self.fingerprint, 'codes': self.codes},
+                      f, indent=1, sort_keys=True)
+        os.replace(tmp_pth, pth)
+        self.new_codes = {}
+
+
 def get_distinct_race_categories(filepath):
     """
     Finds distinct values for race used in the returned clinical trials data.
 
     Args:
-    -- filepath (str): The filepath of the json file returned by the API
+    -- filepath (str): The filepath of the raw trials file returned by the API
 
     Returns:
-        list: Distinct values for race in the json file
+        list: Distinct values for race in the json file, in order of first
+        appearance
     """
-    distinct = []
-    loaded = json.load(open(filepath))
+    # A dict keeps first-seen order with constant time membership checks
+    distinct = {}
 
-    for row in loaded:
+    for row in iter_records(filepath):
         measures = row.get('resultsSection', {})\
                 .get('baselineCharacteristicsModule', {}).get('measures', {})
         for measure in measures:
@@ -39,55 +153,41 @@ def get_distinct_race_categories(filepath):
                 and measure.get('paramType') == 'COUNT_OF_PARTICIPANTS':
                 for cls in measure.get('classes', {}):
                     for cat in cls.get('categories', {}):
-                        if cat.get('title') not in distinct:
-                            distinct.append(cat.get('title'))
-    return distinct
+                        distinct.setdefault(cat.get('title'))
+    return list(distinct)
 
-def collapse_race_data(filepath, recode_all=False):
+def collapse_race_data(filepath, recode_all=False, recoder=None):
     """
     Attempts to apply recoded values based on return distinct fields.
     If recode_all is set to true, applies 'unknown' to all fields it was unable to match.
 
+    Args:
+    -- filepath (str): The filepath of the raw trials file returned by the API
+    -- recode_all (bool): Whether to code unmatched fields as unknown
+    -- recoder (RaceRecoder): The recoder to use. Defaults to one backed by
+        the cache file.
+
     Returns: Dict of applied fields, list of keys of fields that were unmatched.
     """
+    if recoder is None:
+        recoder = RaceRecoder()
 
     recoding_dict = {}
     unmatched = []
 
-    distinct_data = get_distinct_race_categories(filepath)
-
-    for category in distinct_data:
-
-        # Attempt to match values in json to keywords
-        string_cat = str(category)
-        if re.search('multiple|more than one|multi', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = MUL
-        elif re.search('white|caucasian', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = WHITE
-        elif re.search('asian', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = ASIAN
-        elif re.search('black|african', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = BLACK
-        elif re.search('hawaiian', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = HI_PI
-        elif re.search('latin|hispanic|mexican', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = LATINO
-        elif re.search('not latin', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = NOT_LATINO
-        elif re.search('american indian|alaska|native', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = AI_AN
-        elif re.search('other|unknown|refused|not applicable|none|declined|chose not|no response|missing|prefer not|not report',\
-                        string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = UNK
-        elif re.search('multiple|more than one|multi|mixed', string_cat, flags=re.IGNORECASE):
-            recoding_dict[category] = MUL
+    for category in get_distinct_race_categories(filepath):
+        code = recoder.code(category)
+        if code is not None:
+            recoding_dict[category] = code
         elif recode_all:
             recoding_dict[category] = UNK
         else:
             unmatched.append(category)
 
+    recoder.save()
+
     if recode_all:
         return recoding_dict
 
     else:
-        return (recoding_dict, unmatched)
\ No newline at end of file
+        return (recoding_dict, unmatched)
@@ -0,0 +1,133 @@
+"""
+Compact accumulators for the tables extracted from the trials. Rows are
+appended column by column instead of being kept as one dict per row, and
+participant counts are packed into typed arrays, whose values become
+nullable integer columns of a DataFrame without being copied.
+"""
+
+from array import array
+import numpy as np
+import pandas as pd
+
+
+class CountColumn:
+    """
+    A column of participant counts. The API reports counts as strings of
+    digits, which are stored as 64 bit integers, with -1 marking a missing
+    count. If a count that is not a plain whole number is met, the column
+    falls back to keeping every value as given, so nothing is ever
+    rewritten.
+    """
+
+    __slots__ = ("values", "strings")
+
+    def __init__(self):
+        self.values = array("q")
+        # Set to a list of the values as given once the column falls back
+        self.strings = None
+
+    def __len__(self):
+        if self.strings is not None:
+            return len(self.strings)
+        return len(self.values)
+
+    def append(self, value):
+        """
+        Appends one count, a string of digits or None.
+        """
+        if value is None:
+            if self.strings is None:
+                self.values.append(-1)
+            else:
+                self.strings.append(value)
+            return
+
+        if self.strings is None:
+            # Only strings that convert back to themselves are packed, e.g.
+            # not '012', '-1' or '1.5', and only ones that fit in 64 bits
+            try:
+                number = int(value)
+                if number >= 0 and str(number) == value:
+                    self.values.append(number)
+                    return
+            except (ValueError, TypeError, OverflowError):
+                pass
+            self.strings = self.to_list()
+        self.strings.append(value)
+
+    def extend(self, other):
+        """
+        Appends every count of another column.
+        """
+        if self.strings is None and other.strings is None:
+            self.values.extend(other.values)
+        else:
+            if self.strings is None:
+                self.strings = self.to_list()
+            self.strings.extend(other.to_list())
+
+    def to_list(self):
+        """
+        Returns the counts as given: strings of digits, or None.
+        """
+        if self.strings is not None:
+            return list(self.strings)
+        return [None if value < 0 else str(value) for value in self.values]
+
+    def to_array(self):
+        """
+        Returns the counts as a nullable integer array whose values share
+        memory with the column, or as a list if the column fell back to
+        strings.
+        """
+        if self.strings is not None:
+            return self.strings
+        values = np.frombuffer(self.values, dtype=np.int64)
+        return pd.arrays.IntegerArray(values, values < 0)
+
+
+class ColumnTable:
+    """
+    A table accumulated column by column, from rows given as dicts. Count
+    columns are CountColumns, and every other column is a list.
+    """
+
+    __slots__ = ("columns", "appenders")
+
+    def __init__(self, names, count_names=()):
+        """
+        Args:
+            names (list): The column names, in order
+            count_names (list): The names of the participant count columns
+        """
+        self.columns = {name: CountColumn() if name in count_names else []
+                        for name in names}
+        self.appenders = [(name, column.append)
+                          for name, column in self.columns.items()]
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def append(self, row):
+        """
+        Appends one row, a dict holding a value for every column.
+        """
+        for name, append in self.appenders:
+            append(row[name])
+
+    def extend(self, other):
+        """
+        Appends every row of another table with the same columns.
+        """
+        for name, column in self.columns.items():
+            column.extend(other.columns[name])
+
+    def to_frame(self):
+        """
+        Returns the table as a DataFrame. Packed count columns are not
+        copied.
+        """
+        return pd.DataFrame(
+            {name: column.to_array() if isinstance(column, CountColumn)
+             else column for name, column in self.columns.items()},
+            copy=False)
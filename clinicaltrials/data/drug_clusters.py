@@ -0,0 +1,155 @@
+"""
+Clusters of FDA brand names that name the same drug, kept between runs so
+that newly seen brand names can be clustered on their own, against the
+representatives of the existing clusters, instead of deduping the whole
+FDA table again.
+"""
+
+import json
+import os
+import pathlib
+import re
+from collections import defaultdict
+import jellyfish
+
+CLUSTER_STATE = pathlib.Path(__file__).parent / \
+    "../../data/drug_clusters.json"
+
+# The least Jaro-Winkler similarity of a new brand name to a representative
+# for it to join that cluster
+CLUSTER_TOLERANCE = 0.9
+
+# The length of the normalized prefix brand names are blocked on
+PREFIX_LENGTH = 4
+
+
+def clean_brand_name(name):
+    """
+    Lowercases a brand name and collapses its whitespace, as pandas_dedupe
+    does before clustering.
+    """
+    return " ".join(str(name).lower().split())
+
+
+def block_keys(name):
+    """
+    Returns the cheap keys a brand name is blocked on: the start of the
+    name with everything but letters and digits removed, and the phonetic
+    code of its first word. Only names sharing a key are compared.
+    """
+    keys = set()
+    normalized = re.sub(r"[^a-z0-9]", "", name)
+    if normalized:
+        keys.add("prefix:" + normalized[:PREFIX_LENGTH])
+    words = name.split()
+    if words:
+        keys.add("metaphone:" + jellyfish.metaphone(words[0]))
+    return keys
+
+
+class DrugClusters:
+    """
+    Assigns cleaned brand names to clusters. Each cluster is represented by
+    the first brand name put in it, and the canonical drugs are the
+    representatives.
+    """
+
+    def __init__(self, state_path=CLUSTER_STATE):
+        """
+        Args:
+        -- state_path (str): The file clusters are saved to. None disables
+            it.
+        """
+        self.state_path = state_path
+        self.clusters = {}
+        self.representatives = []
+        self.blocks = defaultdict(list)
+        if state_path and pathlib.Path(state_path).exists():
+            with open(state_path) as f:
+                state = json.load(f)
+            self.clusters = state["clusters"]
+            self.representatives = state["representatives"]
+            for cluster_id, name in enumerate(self.representatives):
+                for key in block_keys(name):
+                    self.blocks[key].append(cluster_id)
+
+    def __bool__(self):
+        return bool(self.representatives)
+
+    def new_cluster(self, name):
+        """
+        Starts a cluster represented by a brand name.
+
+        Returns:
+            int: The id of the cluster.
+        """
+        cluster_id = len(self.representatives)
+        self.representatives.append(name)
+        for key in block_keys(name):
+            self.blocks[key].append(cluster_id)
+        self.clusters[name] = cluster_id
+        return cluster_id
+
+    def add_dedupe_clusters(self, names, dedupe_ids):
+        """
+        Replaces every cluster with the clusters found by deduping the whole
+        FDA table.
+
+        Args:
+        -- names (iterable): The cleaned brand name of each FDA record
+        -- dedupe_ids (iterable): The cluster id pandas_dedupe gave each
+            record, or NaN for records it left unclustered
+        """
+        self.clusters = {}
+        self.representatives = []
+        self.blocks = defaultdict(list)
+
+        cluster_ids = {}
+        for name, dedupe_id in zip(names, dedupe_ids):
+            if name in self.clusters:
+                continue
+            if dedupe_id != dedupe_id or dedupe_id not in cluster_ids:
+                cluster_id = self.new_cluster(name)
+                if dedupe_id == dedupe_id:
+                    cluster_ids[dedupe_id] = cluster_id
+            else:
+                self.clusters[name] = cluster_ids[dedupe_id]
+
+    def assign(self, name):
+        """
+        Puts a brand name in the cluster of its most similar representative
+        among those sharing a block key with it, or in a new cluster if none
+        is similar enough. Names already clustered keep their cluster.
+
+        Returns:
+            int: The id of the cluster.
+        """
+        if name in self.clusters:
+            return self.clusters[name]
+
+        candidates = sorted({cluster_id for key in block_keys(name)
+                             for cluster_id in self.blocks.get(key, ())})
+        best_id, best_score = None, CLUSTER_TOLERANCE
+        for cluster_id in candidates:
+            score = jellyfish.jaro_winkler_similarity(
+                self.representatives[cluster_id], name)
+            if score > best_score or (score == best_score and best_id is None):
+                best_id, best_score = cluster_id, score
+
+        if best_id is None:
+            return self.new_cluster(name)
+        self.clusters[name] = best_id
+        return best_id
+
+    def save(self):
+        """
+        Atomically saves the clusters to the state file.
+        """
+        if not self.state_path:
+            return
+        pth = pathlib.Path(self.state_path)
+        tmp_pth = pth.with_name(pth.name + ".tmp")
+        with open(tmp_pth, mode="w") as f:
+            json.dump({"clusters": self.clusters,
+                       "representatives": self.representatives}, f)
+        os.replace(tmp_pth, pth)
@@ -0,0 +1,100 @@
+"""
+An inverted index from character trigrams to canonical drug names, used to
+find the few canonical drugs an intervention name could plausibly match
+before scoring them with a string similarity.
+"""
+
+from collections import defaultdict
+import numpy as np
+
+
+# Characters are counted in this many buckets, by code point
+CHAR_BUCKETS = 32
+
+
+def trigrams(name):
+    """
+    Returns the distinct character trigrams of a name. The name is padded
+    so that its first and last letters get trigrams of their own, which
+    lets short names match.
+    """
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def char_counts(name):
+    """
+    Counts the characters of a name, hashed into CHAR_BUCKETS buckets by
+    code point. Two names cannot have more characters in common than the
+    sum, over the buckets, of the smaller of their counts.
+    """
+    codes = np.frombuffer(name.encode("utf-32-le"), dtype=np.uint32)
+    return np.bincount(codes % CHAR_BUCKETS, minlength=CHAR_BUCKETS)\
+        .astype(np.uint16)
+
+
+class TrigramIndex:
+    """
+    Finds the canonical names sharing enough trigrams with a query name.
+    Unlike blocking on the first letter, names whose first letters differ,
+    e.g. because of a typo or a salt prefix, can still be found. The length
+    and character counts of every name are kept too, to bound the scores
+    of candidates before they are scored.
+    """
+
+    def __init__(self, names, min_similarity=0.3):
+        """
+        Args:
+        -- names (iterable): The canonical names. Names are lowercased, and
+            duplicates and missing names are dropped.
+        -- min_similarity (float): The least Dice similarity of the trigram
+            sets of a query and a name for the name to be a candidate
+        """
+        # A dict keeps the names in first-seen order
+        self.names = list(dict.fromkeys(
+            str(name).lower() for name in names
+            if isinstance(name, str) and name))
+        self.min_similarity = min_similarity
+
+        postings = defaultdict(list)
+        sizes = []
+        for name_id, name in enumerate(self.names):
+            grams = trigrams(name)
+            sizes.append(len(grams))
+            for gram in grams:
+                postings[gram].append(name_id)
+
+        # Postings are kept as arrays, so the names sharing trigrams with a
+        # query are counted in one pass over them
+        self.postings = {gram: np.array(ids, dtype=np.int32)
+                         for gram, ids in postings.items()}
+        self.sizes = np.array(sizes, dtype=np.int32)
+        self.name_array = np.array(self.names, dtype=object)
+        self.lengths = np.array([len(name) for name in self.names],
+                                dtype=np.int32)
+        self.char_counts = np.array(
+            [char_counts(name) for name in self.names],
+            dtype=np.uint16).reshape(len(self.names), CHAR_BUCKETS)
+
+    def candidate_ids(self, query):
+        """
+        Returns the positions in names of the canonical names that could
+        match a query name.
+
+        Args:
+        -- query (str): A lowercased name to look up
+
+        Returns:
+            ndarray: The candidate positions, in increasing order.
+        """
+        grams = trigrams(query)
+        postings = [self.postings[gram] for gram in grams
+                    if gram in self.postings]
+        if not postings:
+            return np.empty(0, dtype=np.int32)
+
+        name_ids, shared = np.unique(np.concatenate(postings),
+                                     return_counts=True)
+        keep = 2 * shared >= self.min_similarity * \
+            (len(grams) + self.sizes[name_ids])
+        return name_ids[keep]
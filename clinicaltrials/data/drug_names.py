@@ -0,0 +1,53 @@
+"""
+Normalizes drug names into keys, so that names differing only by case,
+punctuation, salt form, dosage or dosage form can be joined exactly,
+without being scored. For example, 'Metformin Hydrochloride 500 mg Tablets'
+and 'METFORMIN' both have the key 'metformin'.
+"""
+
+import re
+
+# Doses such as '500 mg', '0.5mg/kg', '10 %' or '40 units/ml'
+DOSE_PATTERN = re.compile(
+    r"\b\d+(?:[.,]\d+)?\s*(?:mg|mcg|µg|ug|g|kg|ml|l|iu|units?|mmol|meq|%)"
+    r"(?:\s*/\s*(?:kg|m2|ml|l|day|d|dose|h|hr|hour))?(?!\w)")
+
+# Salt and hydrate forms, which name the same active ingredient
+SALT_WORDS = frozenset((
+    "acetate", "anhydrous", "benzoate", "besilate", "besylate", "bitartrate",
+    "bromide", "calcium", "carbonate", "chloride", "citrate", "dihydrate",
+    "dihydrochloride", "dipropionate", "disodium", "fumarate", "gluconate",
+    "hcl", "hemihydrate", "hydrobromide", "hydrochloride", "hyclate",
+    "lactate", "magnesium", "maleate", "mesilate", "mesylate", "monohydrate",
+    "nitrate", "oxalate", "phosphate", "potassium", "propionate", "sodium",
+    "succinate", "sulfate", "sulphate", "tartrate", "tosylate", "trihydrate",
+))
+
+# Dosage forms and routes, and the wording of matched comparators
+NOISE_WORDS = frozenset((
+    "capsule", "capsules", "injection", "matching", "oral", "solution",
+    "suspension", "tablet", "tablets",
+))
+
+# Interventions naming any of these are not drugs, and match nothing
+PLACEBO_WORDS = frozenset(("placebo", "placebos", "sham"))
+
+
+def drug_key(name):
+    """
+    Returns the key of a drug name: its words, lowercased, without doses,
+    dosage forms or salt forms. Salt words are kept if nothing else is left,
+    e.g. for 'sodium chloride'.
+
+    Args:
+    -- name (str): A drug or intervention name
+
+    Returns:
+        str: The key, or '' if the name is a placebo or has no words left.
+    """
+    words = re.findall(r"[^\W_]+", DOSE_PATTERN.sub(" ", name.lower()))
+    if PLACEBO_WORDS.intersection(words):
+        return ""
+    words = [word for word in words if word not in NOISE_WORDS]
+    active = [word for word in words if word not in SALT_WORDS]
+    return " ".join(active or words)
@@ -0,0 +1,157 @@
+"""
+Scores blocks of intervention names against their candidate canonical drug
+names in batches, and picks the best matches. When rapidfuzz is installed,
+each intervention is scored against its candidates in one call to its C
+kernel. Otherwise the pairs are scored one by one with jellyfish, which
+gives the same scores, only more slowly. Either way, blocks can be spread
+across worker processes.
+
+Most candidates are never scored. Two names of lengths a and b with m
+characters in common have a Jaro score of at most (m / a + m / b + 1) / 3,
+which is (2 + shorter / longer) / 3 when every character of the shorter
+name is shared. Candidates whose bound falls short of the tolerance, or of
+the best score found so far, are skipped.
+"""
+
+import jellyfish
+import numpy as np
+from drug_index import char_counts
+
+try:
+    from rapidfuzz import process as rapidfuzz_process
+    from rapidfuzz.distance import Jaro, JaroWinkler
+except ImportError:
+    rapidfuzz_process = None
+
+SCORERS = ("jaro", "jaro_winkler")
+
+# Bump whenever a change to the matching logic changes which names match,
+# so saved matches are redone
+MATCHER_VERSION = 2
+
+JELLYFISH_SCORERS = {
+    "jaro": jellyfish.jaro_similarity,
+    "jaro_winkler": jellyfish.jaro_winkler_similarity,
+}
+
+if rapidfuzz_process is not None:
+    RAPIDFUZZ_SCORERS = {
+        "jaro": Jaro.normalized_similarity,
+        "jaro_winkler": JaroWinkler.normalized_similarity,
+    }
+
+# Slack for rounding when comparing scores with their bounds
+EPSILON = 1e-9
+
+
+def score_bounds(query, lengths, counts, scorer="jaro"):
+    """
+    Returns the highest score a query could reach against each of a set of
+    names.
+
+    Args:
+    -- query (str): An intervention name
+    -- lengths (ndarray): The lengths of the names
+    -- counts (ndarray): The character counts of the names, one row per
+        name, as from drug_index.char_counts
+    -- scorer (str): 'jaro' or 'jaro_winkler'
+
+    Returns:
+        ndarray: The bound on the score against each name.
+    """
+    shared = np.minimum(counts, char_counts(query)).sum(axis=1)
+    bounds = (shared / max(len(query), 1) + shared / np.maximum(lengths, 1)
+              + 1) / 3
+    # Names with nothing in common score 0
+    bounds[shared == 0] = 0
+    if scorer == "jaro_winkler":
+        # The prefix bonus closes at most 4 tenths of the remaining gap
+        bounds = 0.6 + 0.4 * bounds
+    return bounds
+
+
+def rank_candidates(query, choices, bounds, tolerance, scorer="jaro",
+                    top_k=1):
+    """
+    Finds the best scoring candidates of an intervention name. Equal
+    scores are ranked in the order of choices, so the result never depends
+    on the order candidates are scored in.
+
+    Args:
+    -- query (str): An intervention name
+    -- choices (ndarray): Its candidate canonical names, in canonical order
+    -- bounds (ndarray): The bound on the score of each candidate
+    -- tolerance (float): The least score of a match
+    -- scorer (str): 'jaro' or 'jaro_winkler'
+    -- top_k (int): The number of matches to return
+
+    Returns:
+        list: Up to top_k (canonical name, score) tuples, best first.
+    """
+    if rapidfuzz_process is not None:
+        positions = np.flatnonzero(bounds >= tolerance - EPSILON)
+        if not len(positions):
+            return []
+        scores = rapidfuzz_process.cdist(
+            [query], choices[positions].tolist(),
+            scorer=RAPIDFUZZ_SCORERS[scorer], dtype=np.float64,
+            workers=1)[0]
+        # rapidfuzz's own cutoff drops pairs scoring exactly the cutoff, so
+        # the tolerance is applied here instead
+        cleared = scores >= tolerance
+        positions, scores = positions[cleared], scores[cleared]
+        ranked = np.lexsort((positions, -scores))[:top_k]
+        return [(choices[positions[i]], float(scores[i])) for i in ranked]
+
+    # Score the candidates with the highest bounds first, and stop once no
+    # remaining candidate could enter the top k
+    similarity = JELLYFISH_SCORERS[scorer]
+    threshold = tolerance
+    ranked = []
+    for position in np.argsort(-bounds, kind="stable"):
+        if bounds[position] < threshold - EPSILON:
+            break
+        score = similarity(choices[position], query)
+        if score < threshold:
+            continue
+
+        ranked.append((-score, position))
+        ranked.sort()
+        del ranked[top_k:]
+        if len(ranked) == top_k:
+            threshold = -ranked[-1][0]
+            # Only an identical name scores 1, and names are distinct
+            if threshold == 1:
+                break
+    return [(choices[position], float(-score))
+            for score, position in ranked]
+
+
+def match_block(queries, candidates, bounds, tolerance, scorer="jaro",
+                top_k=None):
+    """
+    Matches a block of intervention names to canonical names.
+
+    Args:
+    -- queries (list): Intervention names
+    -- candidates (list): For each query, the array of canonical names it
+        is scored against, in canonical order
+    -- bounds (list): For each query, the array of bounds on the scores of
+        its candidates
+    -- tolerance (float): The least score of a match
+    -- scorer (str): 'jaro' or 'jaro_winkler'
+    -- top_k (int): If given, the number of best matches kept for each
+        query, with their scores
+
+    Returns:
+        dict: For each query that has a match, its best scoring canonical
+        name, or if top_k is given, a list of its top_k (canonical name,
+        score) tuples, best first.
+    """
+    matches = {}
+    for query, choices, query_bounds in zip(queries, candidates, bounds):
+        ranked = rank_candidates(query, choices, query_bounds, tolerance,
+                                 scorer, top_k or 1)
+        if ranked:
+            matches[query] = ranked if top_k else ranked[0][0]
+    return matches
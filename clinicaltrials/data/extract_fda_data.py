@@ -2,98 +2,132 @@
 Code for cleaning data from the FDA API and outputting to a CSV file.
 Written by Alison Spencer.
 """
+import argparse
 import json
-import pandas as pd
 import pathlib
+import pandas as pd
+from raw_store import iter_lines, raw_path
+from record_hashes import diff_hashes, hash_records, load_manifest, \
+    record_key, write_manifest
+from table_store import FORMATS, patch_table, table_path, write_table
+
+# Bump whenever a change to the cleaning logic or FDA_COLUMNS changes the
+# rows cleaned from an application, so the saved table is rebuilt
+EXTRACTOR_VERSION = 1
+
+#FDA_COLUMNS is list of variables we will include for each drug
+FDA_COLUMNS = [
+    "submission_status_date",
+    "submission_status",
+    "application_number",
+    "brand_name",
+    "sponsor_name",
+    "generic_name",
+    "substance_name",
+    "manufacturer_name",
+]
 
-def load_fda_data(filepath):
+
+def first(values):
+    """
+    Returns the first item of a list from the API, or None if the list is
+    missing or empty.
     """
-    Cleans JSON data from FDA API into a list of dictionaries.
+    if values:
+        return values[0]
+    return None
+
+
+def load_fda_data(filepath, application_numbers=None):
+    """
+    Cleans newline-delimited JSON data from FDA API into columns. Records are
+    streamed from the file and each field is appended straight to its
+    column, so memory grows with the output rather than the raw data.
+    Missing fields are None.
     
     Args:
         filepath (str): Filepath for the JSON data from API
+        application_numbers (set): If given, only these applications are
+            decoded and cleaned
 
     
     Returns:
-        List of dictionaries, one dictionary for each FDA drug entry of interest.
+        Dictionary of lists, one list for each column in FDA_COLUMNS, with one
+        entry for each FDA drug entry of interest.
     """
 
-    # Load as a series to handle nested data
-    with open(filepath) as json_file:
-        data = json.load(json_file)
-    results_list_of_dct = []
-    for page, _ in enumerate(data):
-        # data[page]['results'] is a list of dictionaries
-        page_i_result = data[page]["results"]
-        for dct in page_i_result:
-            submission_status_date = dct.get("submissions", {})
-            if submission_status_date:
-                submission_status_date = submission_status_date[0].get(
-                    "submission_status_date", {}
-                )
-            submission_status = dct.get("submissions", {})
-            if submission_status:
-                submission_status = submission_status[0].get("submission_status", {})
-            application_number = dct.get("application_number", {})
-
-            if "products" in dct:
-                brand_name = dct.get("products", {})[0].get("brand_name", {})
-            sponsor_name = dct.get("sponsor_name", {})
-            generic_name = None
-            substance_name = None
-            manufacturer_name = None
-            generic_name = dct.get("openfda", {}).get("generic_name", {})
-            if generic_name:
-                generic_name = generic_name[0]
-            substance_name = dct.get("openfda", {}).get("substance_name", {})
-            if substance_name:
-                substance_name = substance_name[0]
-            manufacturer_name = dct.get("openfda", {}).get("manufacturer_name", {})
-            if manufacturer_name:
-                manufacturer_name = manufacturer_name[0]
-            openfda_brand_name = dct.get("openfda", {}).get("brand_name", {})
-
-            drug_dct = {}
-            #var_lst is list of variables we will include in the dictionary
-            #for each drug
-            var_lst = [
-                "submission_status_date",
-                "submission_status",
-                "application_number",
-                "brand_name",
-                "sponsor_name",
-                "generic_name",
-                "substance_name",
-                "manufacturer_name",
-            ]
-            for var in var_lst:
-                drug_dct[var] = locals()[var]
-            for key in dct:
-                if dct[key] == {}:
-                    dct[key] is None
-            results_list_of_dct.append(drug_dct)
-    return results_list_of_dct
-
-
-def generate_fda_csv(filepath, filename):
+    columns = {column: [] for column in FDA_COLUMNS}
+    for line in iter_lines(filepath):
+        if application_numbers is not None and \
+                record_key(line, "fda") not in application_numbers:
+            continue
+        dct = json.loads(line)
+        submission = first(dct.get("submissions")) or {}
+        product = first(dct.get("products")) or {}
+        openfda = dct.get("openfda") or {}
+
+        columns["submission_status_date"].append(
+            submission.get("submission_status_date"))
+        columns["submission_status"].append(
+            submission.get("submission_status"))
+        columns["application_number"].append(dct.get("application_number"))
+        columns["brand_name"].append(product.get("brand_name"))
+        columns["sponsor_name"].append(dct.get("sponsor_name"))
+        columns["generic_name"].append(first(openfda.get("generic_name")))
+        columns["substance_name"].append(first(openfda.get("substance_name")))
+        columns["manufacturer_name"].append(
+            first(openfda.get("manufacturer_name")))
+    return columns
+
+
+def generate_fda_csv(filepath, filename, full=False):
     """
-    Takes JSON data from API, cleans it, and converts to a csv file.
+    Takes JSON data from API, cleans it, and converts to a csv file, or to a
+    Parquet file if filename ends in .parquet. When the file was written
+    before, only applications whose content hash changed are cleaned again
+    and patched into it, and deleted applications are dropped.
     
     Args:
         filepath (str): Filepath for the JSON data from API
-        filename (str): The name of the file to write the CSV to
+        filename (str): The name of the file to write the table to
+        full (bool): Whether to rebuild the whole file from scratch
 
     
     Returns:
         CSV of cleaned FDA API data.
     """
+    filename = pathlib.Path(filename)
+    manifest = f"fda_{filename.suffix.lstrip('.')}"
+    # The table only carries over when cleaned by the same extractor
+    settings = {"version": EXTRACTOR_VERSION}
+    hashes = hash_records(filepath, "fda")
+    old_hashes = None
+    if not full and filename.exists():
+        old_hashes = load_manifest(manifest, settings)
 
-    data = load_fda_data(filepath)
-    df = pd.DataFrame.from_dict(data)
-    df.to_csv(filename, sep=",", index=False, encoding="utf-8")
+    if old_hashes is None:
+        data = load_fda_data(filepath)
+        write_table(pd.DataFrame(data, columns=FDA_COLUMNS), filename)
+    else:
+        changed, deleted = diff_hashes(old_hashes, hashes)
+        print(f"{len(changed)} new or changed applications, {len(deleted)} "
+              f"deleted, {len(hashes) - len(changed)} unchanged")
+        if changed or deleted:
+            data = load_fda_data(filepath, changed)
+            patch_table(pd.DataFrame(data, columns=FDA_COLUMNS), filename,
+                        "application_number", changed | deleted)
+    write_manifest(manifest, settings, hashes)
 
 if __name__ == "__main__":
-    pth = pathlib.Path(__file__).parent / f"../../data/fda.json"
-    out_filename = pathlib.Path(__file__).parent / f"../../data/csvs/fda_full.csv"
-    generate_fda_csv(pth, out_filename)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--format", choices=FORMATS, default="csv",
+                        help="output format of the extracted table")
+    parser.add_argument("--full", action="store_true",
+                        help="rebuild the table instead of re-cleaning only "
+                             "changed applications")
+    args = parser.parse_args()
+
+    pth = raw_path("fda")
+    out_filename = table_path("fda_full", args.format)
+    generate_fda_csv(pth, out_filename, full=args.full)
 
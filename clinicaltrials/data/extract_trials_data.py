@@ -5,12 +5,25 @@ loading to the SQL database.
 
 Written by Caitlin Pratt
 """
-import json
-import pathlib
-import pandas as pd
-from collapse_race_data import collapse_race_data, \
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from collapse_race_data import RaceRecoder, \
     WHITE, BLACK, ASIAN, AI_AN, HI_PI, LATINO, NOT_LATINO, MUL, UNK
 from collapse_drug_data import recode_trial_drugs
+from column_buffers import ColumnTable
+from raw_store import iter_lines, raw_path
+from record_hashes import diff_hashes, hash_records, load_manifest, \
+    record_key, write_manifest
+from table_store import FORMATS, RACE_COLUMNS, patch_table, table_path, \
+    write_table
+from study_decoder import DECODERS, get_decoder
+
+# Bump whenever a change to the extraction logic or the table columns
+# changes the rows extracted from a study, so saved tables are rebuilt
+EXTRACTOR_VERSION = 1
 
 
 def extract_fields(row):
@@ -97,16 +110,17 @@ def extract_trial_sex(nct_id, row):
     return counts_dict
 
 
-def extract_trial_race(nct_id, row, recoded_data):
+def extract_trial_race(nct_id, row, recoder):
     """
     Extracts race data from a single entry in the json returned by the
-    Clinical Trials API.
+    Clinical Trials API. Race category titles are recoded as they are met,
+    and titles matching no keyword are coded as unknown.
 
     Args:
         -- nct_id (str): The nct_id of the row used in extraction.
         -- row (json object): One row in the clinical trials json
-        -- recoded_data (dict): A dict of recoded race fields used for
-            collapsing race data
+        -- recoder (RaceRecoder): Recodes race category titles to
+            standardized categories
     Returns:
         -- dict: A dictionary of extracted race data for one trial
     """
@@ -131,7 +145,7 @@ def extract_trial_race(nct_id, row, recoded_data):
             for cls in measure.get('classes', {}):
                 for cat in cls.get('categories', {}):
                     if cat.get('title'):
-                        code = recoded_data[cat.get('title')]
+                        code = recoder.code(cat.get('title')) or UNK
                         if cat.get('measurements', []):
                             race_dict[code] = cat.get(
                                 'measurements')[-1]['value']
@@ -182,120 +196,202 @@ def extract_trial_conditions(fields):
             "keywords": keywords_flat,
         }
 
-# Function written by James Turk
+
+SEX_COUNTS = ['female', 'male', 'total']
 
 
-def generate_iv_loc_cond_csvs(filepath):
+def new_tables():
     """
-    Takes the filpath of the raw data JSON file, extracts fields,
-    and saves them to separate csvs for loading and manipulation.
+    Returns empty accumulators for every table extracted from the trials,
+    as ColumnTables with the participant counts packed into typed arrays.
     """
-
-    loaded = json.load(open(filepath))
-
-    extraction_functions = {
-        "trial_interventions_raw": extract_interventions,
-        "trial_locations": extract_trial_locations,
-        "trial_conditions": extract_trial_conditions,
+    return {
+        'trials': ColumnTable(['nct_id', 'brief_title', 'official_title',
+                               'lead_sponsor']),
+        'trial_status': ColumnTable(['nct_id', 'overall_status', 'start_date',
+                                     'completion_date', 'why_stopped']),
+        'trial_race': ColumnTable(['nct_id'] + RACE_COLUMNS, RACE_COLUMNS),
+        'trial_sex': ColumnTable(['nct_id'] + SEX_COUNTS, SEX_COUNTS),
+        'trial_interventions_raw': ColumnTable(['nct_id',
+                                                'intervention_name']),
+        'trial_locations': ColumnTable(['nct_id', 'city', 'country']),
+        'trial_conditions': ColumnTable(['nct_id', 'condition', 'keywords']),
     }
 
-    for dict_name, extraction_func in extraction_functions.items():
-        ext_data = []
-        for row in loaded:
-            # API object 'row' -> nested dict 'fields'
-            fields = extract_fields(row)
-            # each fields object returns >=1 output row
-            ext_data.extend(extraction_func(fields))
-        df = pd.DataFrame(ext_data)
-
-        filename = pathlib.Path(__file__).parent / \
-            f"../../data/csvs/{dict_name}.csv"
-        df.to_csv(filename, index=None)
 
-    # Create recoded file from trial interventions data
-    fda_filename = pathlib.Path(__file__).parent / \
-        f"../../data/csvs/fda_full.csv"
-    interventions_filename = pathlib.Path(
-        __file__).parent / f"../../data/csvs/trial_interventions_raw.csv"
-    recode_trial_drugs(fda_filename, interventions_filename)
+# Row extractors written by James Turk
+EXTRACTION_FUNCTIONS = {
+    "trial_interventions_raw": extract_interventions,
+    "trial_locations": extract_trial_locations,
+    "trial_conditions": extract_trial_conditions,
+}
 
 
-def generate_sex_csv(filepath):
+def extract_tables(lines, recoder, decoder='auto'):
     """
-    Generates a csv of extracted sex data from the Clinical Trials API.
+    Extracts every table from a chunk of raw studies. Each study is decoded,
+    passed through extract_fields once, and fanned out to all tables.
+
+    Args:
+        -- lines (list): Undecoded JSON lines, one per study
+        -- recoder (RaceRecoder): Recodes race category titles
+        -- decoder (str): The decoding backend, see study_decoder
+    Returns:
+        -- tuple: The tables extracted from the chunk, as from new_tables,
+            and the race titles the recoder classified for the first time
     """
-    sex_counts_final = {'nct_id': [], 'female': [], 'male': [], 'total': []}
-    loaded = json.load(open(filepath))
+    tables = new_tables()
+    decode = get_decoder(decoder)
 
-    for row in loaded:
-        nct_id = extract_fields(row)['nct_id']
+    for line in lines:
+        row = decode(line)
+        # API object 'row' -> nested dict 'fields'
+        fields = extract_fields(row)
+        # Every row of the study, in every table, shares one id string
+        if isinstance(fields['nct_id'], str):
+            fields['nct_id'] = sys.intern(fields['nct_id'])
+        nct_id = fields['nct_id']
+        race_counts = extract_trial_race(nct_id, row, recoder)
         sex_counts = extract_trial_sex(nct_id, row)
 
-        for key in sex_counts.keys():
-            sex_counts_final[key].append(sex_counts[key])
+        for dict_name, source in (('trials', fields),
+                                  ('trial_status', fields),
+                                  ('trial_race', race_counts),
+                                  ('trial_sex', sex_counts)):
+            tables[dict_name].append(source)
 
-    filename = pathlib.Path(__file__).parent / f"../../data/csvs/trial_sex.csv"
-    df_of_dictionary = pd.DataFrame(sex_counts_final)
-    df_of_dictionary.to_csv(filename, index=None)
+        # each fields object returns >=1 output row
+        for dict_name, extraction_func in EXTRACTION_FUNCTIONS.items():
+            table = tables[dict_name]
+            for extracted_row in extraction_func(fields):
+                table.append(extracted_row)
 
+    return tables, recoder.new_codes
 
-def generate_race_csv(filepath):
+
+def merge_tables(tables, recoder, chunk_result):
     """
-    Generates a csv of extracted race data from the Clinical Trials API.
+    Appends the tables extracted from one chunk onto the running tables, and
+    keeps the race titles classified while extracting it.
     """
-    race_counts_final = {'nct_id': [], AI_AN: [], ASIAN: [], BLACK: [],
-        HI_PI: [], WHITE: [], MUL: [], LATINO: [], NOT_LATINO: [], UNK: []}
-
-    loaded = json.load(open(filepath))
-
-    recoded_data = collapse_race_data('data/trials.json', recode_all=True)
-
-    for row in loaded:
-        nct_id = extract_fields(row)['nct_id']
-        race_counts = extract_trial_race(nct_id, row, recoded_data)
+    chunk_tables, new_codes = chunk_result
+    recoder.update(new_codes)
+    for dict_name, chunk_table in chunk_tables.items():
+        tables[dict_name].extend(chunk_table)
 
-        for key in race_counts.keys():
-            race_counts_final[key].append(race_counts[key])
 
-    filename = pathlib.Path(__file__).parent / \
-        f"../../data/csvs/trial_race.csv"
-    df_of_dictionary = pd.DataFrame(race_counts_final)
-    df_of_dictionary.to_csv(filename, index=None)
-
-
-def generate_trial_csvs(filepath):
+def iter_chunks(filepath, chunk_size, nct_ids=None):
     """
-    Takes the filpath of the raw data JSON file, extracts fields,
-    and saves them to separate csvs for loading and manipulation.
+    Splits the raw studies into lists of at most chunk_size JSON lines,
+    keeping only the studies in nct_ids if it is given.
     """
+    chunk = []
+    for line in iter_lines(filepath):
+        if nct_ids is not None and record_key(line, 'trials') not in nct_ids:
+            continue
+        chunk.append(line)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def generate_trial_csvs(filepath, processes=1, chunk_size=1000, fmt='csv',
+                        decoder='auto', full=False):
+    """
+    Takes the filpath of the raw data file, extracts fields, and saves them
+    to separate csvs for loading and manipulation. The raw studies are
+    streamed in chunks, and with more than one process the chunks are
+    extracted in parallel. Chunk results are always merged in file order,
+    so the output does not depend on the number of processes.
 
-    loaded = json.load(open(filepath))
-
-    trial_dicts = {
-        'trials': {'nct_id': [], 'brief_title': [], 'official_title': [], 
-                   'lead_sponsor': []},
-        'trial_status': {'nct_id': [], 'overall_status': [], 'start_date': [],\
-                          'completion_date': [], 'why_stopped': []},
-    }
-
-    for row in loaded:
-        fields = extract_fields(row)
+    When the tables were built before, only studies whose content hash
+    changed are extracted, and their rows are patched into the saved
+    tables, after the rows of unchanged studies. Rows of deleted studies
+    are dropped.
 
-        for dict_name, dictionary in trial_dicts.items():
-            for key in dictionary.keys():
-                dictionary[key].append(fields[key])
+    Args:
+        -- filepath (str): The filepath of the raw trials file
+        -- processes (int): The number of worker processes. 1 extracts in
+            this process.
+        -- chunk_size (int): The number of studies in each chunk
+        -- fmt (str): The output format, 'csv' or 'parquet'
+        -- decoder (str): The decoding backend, 'stdlib', 'msgspec', or
+            'auto' to use msgspec when it is installed
+        -- full (bool): Whether to rebuild every table from scratch
+    """
+    # Race titles are classified the first time they are met during the
+    # pass, and remembered between runs
+    recoder = RaceRecoder()
+    tables = new_tables()
+
+    # Each output format has its own manifest, and tables only carry over
+    # when built by the same extractor with the same race patterns
+    manifest = f'trials_{fmt}'
+    settings = {'version': EXTRACTOR_VERSION,
+                'race_patterns': recoder.fingerprint}
+    hashes = hash_records(filepath, 'trials')
+    old_hashes = None
+    if not full and all(table_path(name, fmt).exists() for name in tables):
+        old_hashes = load_manifest(manifest, settings)
+
+    if old_hashes is None:
+        nct_ids = None
+    else:
+        changed, deleted = diff_hashes(old_hashes, hashes)
+        nct_ids = changed
+        print(f"{len(changed)} new or changed studies, {len(deleted)} "
+              f"deleted, {len(hashes) - len(changed)} unchanged")
+    chunks = iter_chunks(filepath, chunk_size, nct_ids)
+
+    if processes == 1:
+        for chunk in chunks:
+            merge_tables(tables, recoder,
+                         extract_tables(chunk, recoder, decoder))
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            # Keep a bounded window of chunks in flight, so the raw file is
+            # never held in memory all at once
+            pending = deque()
+            for chunk in chunks:
+                pending.append(
+                    executor.submit(extract_tables, chunk, recoder, decoder))
+                if len(pending) >= 2 * processes:
+                    merge_tables(tables, recoder, pending.popleft().result())
+            while pending:
+                merge_tables(tables, recoder, pending.popleft().result())
+    recoder.save()
+
+    for dict_name, table in tables.items():
+        if old_hashes is None:
+            write_table(table.to_frame(), table_path(dict_name, fmt))
+        elif changed or deleted:
+            patch_table(table.to_frame(), table_path(dict_name, fmt),
+                        'nct_id', changed | deleted)
+    write_manifest(manifest, settings, hashes)
 
-    for dict_name, dictionary in trial_dicts.items():
-        filename = pathlib.Path(__file__).parent / \
-            f"../../data/csvs/{dict_name}.csv"
-        df_of_dictionary = pd.DataFrame(dictionary)
-        df_of_dictionary.to_csv(filename, index=None)
+    # Create recoded file from trial interventions data
+    fda_filename = table_path('fda_full', fmt)
+    interventions_filename = table_path('trial_interventions_raw', fmt)
+    recode_trial_drugs(fda_filename, interventions_filename,
+                       processes=processes)
 
 
 if __name__ == "__main__":
-    # generate all five CSVs
-    pth = pathlib.Path(__file__).parent / f"../../data/trials.json"
-    generate_trial_csvs(pth)
-    generate_iv_loc_cond_csvs(pth)
-    generate_race_csv(pth)
-    generate_sex_csv(pth)
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='number of worker processes used to extract')
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='output format of the extracted tables')
+    parser.add_argument('--decoder', choices=DECODERS, default='auto',
+                        help='JSON decoding backend for the raw studies')
+    parser.add_argument('--full', action='store_true',
+                        help='rebuild every table instead of re-extracting '
+                             'only changed studies')
+    args = parser.parse_args()
+
+    # generate all eight trial tables
+    pth = raw_path("trials")
+    generate_trial_csvs(pth, processes=args.processes, fmt=args.format,
+                        decoder=args.decoder, full=args.full)
@@ -1,33 +1,40 @@
 """
-Loads CSVs generated by the extract_trials_data and extract_fda_data
-modules to a SQLite database. Creates the joined trials table.
+Loads CSVs (or Parquet files) generated by the extract_trials_data and
+extract_fda_data modules to a SQLite database. Creates the joined trials
+table.
 
 Written by Caitlin Pratt
 """
+import argparse
 import sqlite3
 import pathlib
-import pandas as pd
-
-FILES = [
-    'trial_conditions.csv',
-    'trial_interventions.csv',
-    'trial_locations.csv',
-    'trial_race.csv',
-    'trial_sex.csv',
-    'fda_full.csv',
-    'trials.csv',
-    'trial_status.csv'
+from table_store import FORMATS, read_table, table_path
+
+TABLES = [
+    'trial_conditions',
+    'trial_interventions',
+    'trial_locations',
+    'trial_race',
+    'trial_sex',
+    'fda_full',
+    'trials',
+    'trial_status'
 ]
 
-def makedb():
+def makedb(fmt='csv'):
+    """
+    Loads every extracted table to the database.
+
+    Args:
+        fmt (str): The format the tables were extracted in, 'csv' or
+            'parquet'
+    """
     db_pth = pathlib.Path(__file__).parent / f"../../data/trials.db"
     conn = sqlite3.connect(db_pth)
     c = conn.cursor()
 
-    for file in FILES:
-        filepath = pathlib.Path(__file__).parent / f"../../data/csvs/{file}"
-        df = pd.read_csv(f'data/csvs/{file}')
-        table_name = file.split('.')[0]
+    for table_name in TABLES:
+        df = read_table(table_path(table_name, fmt))
 
         df.to_sql(table_name, con=conn, if_exists='replace', index=False)
     
@@ -40,4 +47,9 @@ def makedb():
     c.close()
 
 if __name__ == "__main__":
-    makedb()
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--format', choices=FORMATS, default='csv',
+                        help='format the tables were extracted in')
+    args = parser.parse_args()
+
+    makedb(fmt=args.format)
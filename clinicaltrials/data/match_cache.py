@@ -0,0 +1,92 @@
+"""
+Remembers which canonical drugs intervention names were matched to, across
+runs, so only names never seen before are scored again. Matches only carry
+over while the canonical drug names and the matcher settings are unchanged.
+"""
+
+import hashlib
+import json
+import os
+import pathlib
+
+MATCH_CACHE = pathlib.Path(__file__).parent / "../../data/drug_matches.json"
+
+
+def matcher_fingerprint(canonical_names, settings):
+    """
+    Fingerprints everything the matches depend on.
+
+    Args:
+    -- canonical_names (list): The canonical names, in order
+    -- settings (dict): The matcher version and settings, e.g. the
+        tolerance and scorer
+
+    Returns:
+        str: A hash that changes whenever any of them does.
+    """
+    digest = hashlib.sha1(json.dumps(settings, sort_keys=True)
+                          .encode("utf-8"))
+    for name in canonical_names:
+        digest.update(name.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class MatchCache:
+    """
+    The matches of intervention names, keyed by name, each a list of
+    (canonical name, score) pairs, best first. Names that matched nothing
+    are kept too, with an empty list.
+    """
+
+    def __init__(self, fingerprint, cache_path=MATCH_CACHE):
+        """
+        Args:
+        -- fingerprint (str): The matcher fingerprint, from
+            matcher_fingerprint. Matches saved under another fingerprint are
+            discarded.
+        -- cache_path (str): The file matches are saved to. None disables
+            the cache file.
+        """
+        self.fingerprint = fingerprint
+        self.cache_path = cache_path
+        self.matches = {}
+        self.changed = False
+        if cache_path and pathlib.Path(cache_path).exists():
+            with open(cache_path) as f:
+                cached = json.load(f)
+            if cached.get("fingerprint") == fingerprint:
+                self.matches = {name: [tuple(match) for match in ranked]
+                                for name, ranked in cached["matches"].items()}
+
+    def missing(self, names):
+        """
+        Returns the names that have not been matched yet, in order.
+        """
+        return [name for name in names if name not in self.matches]
+
+    def update(self, names, matches):
+        """
+        Remembers the matches of newly scored names.
+
+        Args:
+        -- names (list): Every name that was scored
+        -- matches (dict): The ranked matches of the names that have any
+        """
+        for name in names:
+            self.matches[name] = matches.get(name, [])
+        self.changed = self.changed or bool(names)
+
+    def save(self):
+        """
+        Atomically saves the matches to the cache file, if any are new.
+        """
+        if not self.cache_path or not self.changed:
+            return
+        pth = pathlib.Path(self.cache_path)
+        tmp_pth = pth.with_name(pth.name + ".tmp")
+        with open(tmp_pth, mode="w") as f:
+            json.dump({"fingerprint": self.fingerprint,
+                       "matches": self.matches}, f)
+        os.replace(tmp_pth, pth)
+        self.changed = False
@@ -0,0 +1,69 @@
+"""
+Readers for the raw data files written by the API fetchers. Raw files are
+gzipped newline-delimited JSON, one record per line, so they can be
+decompressed and consumed one record at a time instead of loading the whole
+file into memory.
+"""
+
+import gzip
+import json
+import pathlib
+
+RAW_DIR = pathlib.Path(__file__).parent / "../../data"
+
+
+def raw_path(source):
+    """
+    Returns the path of the raw data file written by a fetcher.
+
+    Args:
+        source (str): The name of the raw data, e.g. 'trials' or 'fda'
+    """
+    return RAW_DIR / f"{source}.jsonl.gz"
+
+
+def open_raw(filepath):
+    """
+    Opens a raw data file for reading as text, decompressing it if it is
+    gzipped. Uncompressed .jsonl files are still accepted.
+
+    Args:
+        filepath (str): Filepath of the raw data file written by a fetcher
+
+    Returns:
+        A text file object.
+    """
+    if str(filepath).endswith(".gz"):
+        return gzip.open(filepath, mode="rt")
+    return open(filepath)
+
+
+def iter_lines(filepath):
+    """
+    Lazily yields the undecoded JSON line of each record in a raw data file,
+    for callers that decode records elsewhere, e.g. in worker processes.
+
+    Args:
+        filepath (str): Filepath of the raw data file written by a fetcher
+
+    Returns:
+        Generator of str, one for each record in the file.
+    """
+    with open_raw(filepath) as f:
+        for line in f:
+            if line.strip():
+                yield line
+
+
+def iter_records(filepath):
+    """
+    Lazily yields records from a raw data file.
+
+    Args:
+        filepath (str): Filepath of the raw data file written by a fetcher
+
+    Returns:
+        Generator of dicts, one for each record in the file.
+    """
+    for line in iter_lines(filepath):
+        yield json.loads(line)
@@ -0,0 +1,116 @@
+"""
+Content hashes of the records in the raw data files, used to re-extract
+only the records that changed since the tables were last built. Each record
+is fingerprinted by the hash of its raw JSON line and keyed by its id, the
+nctId of a study or the application_number of an FDA application. The
+hashes the tables were built from are kept in a manifest next to the tables.
+"""
+
+import hashlib
+import json
+import os
+import re
+from raw_store import iter_lines
+from table_store import TABLE_DIR
+
+# Ids are read from the undecoded lines, so unchanged records are never
+# decoded. Nested openfda application numbers are lists and do not match.
+KEY_PATTERNS = {
+    "trials": re.compile(r'"nctId"\s*:\s*"([^"]*)"'),
+    "fda": re.compile(r'"application_number"\s*:\s*"([^"]*)"'),
+}
+
+
+def record_key(line, source):
+    """
+    Returns the id of the record in a raw JSON line, or an empty string for
+    records without one, which are then handled together.
+
+    Args:
+        line (str): An undecoded JSON line from a raw data file
+        source (str): The name of the raw data, 'trials' or 'fda'
+    """
+    match = KEY_PATTERNS[source].search(line)
+    if match:
+        return match.group(1)
+    return ""
+
+
+def hash_records(filepath, source):
+    """
+    Fingerprints every record of a raw data file.
+
+    Args:
+        filepath (str): Filepath of the raw data file written by a fetcher
+        source (str): The name of the raw data, 'trials' or 'fda'
+
+    Returns:
+        dict: The content hash of each record, keyed by record id. Lines
+        sharing an id are hashed together, in file order.
+    """
+    hashes = {}
+    for line in iter_lines(filepath):
+        key = record_key(line, source)
+        digest = hashlib.sha1(line.strip().encode("utf-8")).hexdigest()
+        if key in hashes:
+            digest = hashlib.sha1(
+                (hashes[key] + digest).encode("utf-8")).hexdigest()
+        hashes[key] = digest
+    return hashes
+
+
+def diff_hashes(old, new):
+    """
+    Compares the record hashes the tables were built from with the current
+    ones.
+
+    Returns:
+        tuple: The set of ids of changed or new records, and the set of ids
+        of records that were deleted.
+    """
+    changed = {key for key, digest in new.items() if old.get(key) != digest}
+    deleted = set(old) - set(new)
+    return changed, deleted
+
+
+def manifest_path(name):
+    """
+    Returns the path of the manifest of a set of extracted tables, e.g.
+    'trials_csv' for the trials tables saved as CSVs.
+    """
+    return TABLE_DIR / f"{name}_manifest.json"
+
+
+def load_manifest(name, settings):
+    """
+    Loads the record hashes the saved tables were built from.
+
+    Args:
+        name (str): The name of the manifest, see manifest_path
+        settings (dict): Anything else the tables depend on. Tables built
+            with other settings are not reused.
+
+    Returns:
+        dict: The record hashes, or None if the tables must be rebuilt.
+    """
+    pth = manifest_path(name)
+    if not pth.exists():
+        return None
+
+    with open(pth) as f:
+        manifest = json.load(f)
+    if manifest.get("settings") != settings:
+        return None
+    return manifest["hashes"]
+
+
+def write_manifest(name, settings, hashes):
+    """
+    Atomically saves the record hashes the tables were just built from.
+    """
+    pth = manifest_path(name)
+    tmp_pth = TABLE_DIR / f"{name}_manifest.json.tmp"
+
+    with open(tmp_pth, mode="w") as f:
+        json.dump({"settings": settings, "hashes": hashes}, f)
+    os.replace(tmp_pth, pth)
@@ -0,0 +1,138 @@
+"""
+Decoders turning raw trials JSON lines into the dicts read by the
+extractors. The standard library decoder builds every field of every study.
+When msgspec is installed, a typed schema covering only the fields the
+extractors read is used instead: everything else is skipped while
+decoding, and the result is converted back to plain dicts holding just
+those fields.
+"""
+
+import json
+from functools import lru_cache
+from typing import List, Optional
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+DECODERS = ("auto", "stdlib", "msgspec")
+
+
+if msgspec is not None:
+
+    class Schema(msgspec.Struct, rename="camel", omit_defaults=True):
+        """
+        Base for the study schema. Fields are named in snake case and read
+        from camel case keys, and missing fields are left out of the dicts
+        built from them.
+        """
+
+    class DateStruct(Schema):
+        date: Optional[str] = None
+
+    class IdentificationModule(Schema):
+        nct_id: Optional[str] = None
+        brief_title: Optional[str] = None
+        official_title: Optional[str] = None
+
+    class StatusModule(Schema):
+        overall_status: Optional[str] = None
+        start_date_struct: Optional[DateStruct] = None
+        primary_completion_date_struct: Optional[DateStruct] = None
+        why_stopped: Optional[str] = None
+
+    class LeadSponsor(Schema):
+        name: Optional[str] = None
+
+    class SponsorCollaboratorsModule(Schema):
+        lead_sponsor: Optional[LeadSponsor] = None
+
+    class Location(Schema):
+        city: Optional[str] = None
+        country: Optional[str] = None
+
+    class ContactsLocationsModule(Schema):
+        locations: Optional[List[Location]] = None
+
+    class Intervention(Schema):
+        name: Optional[str] = None
+
+    class ArmsInterventionsModule(Schema):
+        interventions: Optional[List[Intervention]] = None
+
+    class ConditionsModule(Schema):
+        conditions: Optional[List[str]] = None
+        keywords: Optional[List[str]] = None
+
+    class ProtocolSection(Schema):
+        identification_module: Optional[IdentificationModule] = None
+        status_module: Optional[StatusModule] = None
+        sponsor_collaborators_module: \
+            Optional[SponsorCollaboratorsModule] = None
+        contacts_locations_module: Optional[ContactsLocationsModule] = None
+        arms_interventions_module: Optional[ArmsInterventionsModule] = None
+        conditions_module: Optional[ConditionsModule] = None
+
+    class Count(Schema):
+        value: Optional[str] = None
+
+    class Denom(Schema):
+        counts: Optional[List[Count]] = None
+
+    class Category(Schema):
+        title: Optional[str] = None
+        measurements: Optional[List[Count]] = None
+
+    class MeasureClass(Schema):
+        denoms: Optional[List[Denom]] = None
+        categories: Optional[List[Category]] = None
+
+    class Measure(Schema):
+        title: Optional[str] = None
+        param_type: Optional[str] = None
+        classes: Optional[List[MeasureClass]] = None
+
+    class BaselineCharacteristicsModule(Schema):
+        measures: Optional[List[Measure]] = None
+
+    class ResultsSection(Schema):
+        baseline_characteristics_module: \
+            Optional[BaselineCharacteristicsModule] = None
+
+    class Study(Schema):
+        protocol_section: Optional[ProtocolSection] = None
+        results_section: Optional[ResultsSection] = None
+
+
+@lru_cache(maxsize=None)
+def get_decoder(backend="auto"):
+    """
+    Returns a function decoding one raw trials JSON line into a dict.
+
+    Args:
+        backend (str): 'stdlib', 'msgspec', or 'auto' to use msgspec when it
+            is installed
+
+    Returns:
+        function: Takes a JSON line and returns a dict.
+    """
+    if backend not in DECODERS:
+        raise ValueError(f"Unknown decoder {backend!r}, expected one of "
+                         f"{DECODERS}")
+    if backend == "auto":
+        backend = "stdlib" if msgspec is None else "msgspec"
+
+    if backend == "stdlib":
+        return json.loads
+
+    if msgspec is None:
+        raise ImportError("The msgspec decoder requires msgspec to be "
+                          "installed")
+
+    decoder = msgspec.json.Decoder(Study)
+
+    def decode(line):
+        return msgspec.to_builtins(decoder.decode(line))
+
+    return decode
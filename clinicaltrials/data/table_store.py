@@ -0,0 +1,142 @@
+"""
+Reads and writes the extracted tables that are loaded to the SQL database.
+Tables are saved to the csvs folder either as CSVs or, when columnar output
+is chosen, as Parquet files with explicit column types, so they can be
+loaded without re-inferring types from text. Parquet requires pyarrow.
+"""
+
+import pathlib
+import pandas as pd
+from collapse_race_data import \
+    WHITE, BLACK, ASIAN, AI_AN, HI_PI, LATINO, NOT_LATINO, MUL, UNK
+
+TABLE_DIR = pathlib.Path(__file__).parent / "../../data/csvs"
+
+FORMATS = ("csv", "parquet")
+
+RACE_COLUMNS = [AI_AN, ASIAN, BLACK, HI_PI, WHITE, MUL, LATINO, NOT_LATINO,
+                UNK]
+
+# Column types used for columnar output. Counts are nullable integers, since
+# many trials do not report them.
+TABLE_DTYPES = {
+    "trials": {"nct_id": "string", "brief_title": "string",
+               "official_title": "string", "lead_sponsor": "string"},
+    "trial_status": {"nct_id": "string", "overall_status": "string",
+                     "start_date": "string", "completion_date": "string",
+                     "why_stopped": "string"},
+    "trial_interventions_raw": {"nct_id": "string",
+                                "intervention_name": "string"},
+    "trial_interventions": {"nct_id": "string",
+                            "intervention_name": "string"},
+    "trial_locations": {"nct_id": "string", "city": "string",
+                        "country": "string"},
+    "trial_conditions": {"nct_id": "string", "condition": "string",
+                         "keywords": "string"},
+    "trial_race": {"nct_id": "string",
+                   **{column: "Int64" for column in RACE_COLUMNS}},
+    "trial_sex": {"nct_id": "string", "female": "Int64",
+                  "male": "Int64", "total": "Int64"},
+    "fda_full": {"submission_status_date": "string",
+                 "submission_status": "string",
+                 "application_number": "string", "brand_name": "string",
+                 "sponsor_name": "string", "generic_name": "string",
+                 "substance_name": "string", "manufacturer_name": "string"},
+}
+
+
+def table_path(name, fmt="csv"):
+    """
+    Returns the path of an extracted table.
+
+    Args:
+        name (str): The name of the table, e.g. 'trials'
+        fmt (str): 'csv' or 'parquet'
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown table format {fmt!r}, expected one of "
+                         f"{FORMATS}")
+    return TABLE_DIR / f"{name}.{fmt}"
+
+
+def apply_dtypes(df, name):
+    """
+    Casts the columns of a table to their declared types. Count columns
+    arrive from the API as strings, so they are parsed as numbers first.
+    """
+    dtypes = TABLE_DTYPES.get(name, {})
+    for column, dtype in dtypes.items():
+        if column not in df:
+            continue
+        if dtype == "string":
+            df[column] = df[column].astype("string")
+        else:
+            df[column] = pd.to_numeric(df[column], errors="coerce")\
+                .astype(dtype)
+    return df
+
+
+def write_table(table, path):
+    """
+    Saves a table, in the format given by the file extension of path.
+
+    Args:
+        table (DataFrame, dict or list): The table, as a DataFrame, a dict
+            of column lists, or a list of row dicts
+        path (Path): Where to save it, from table_path
+    """
+    path = pathlib.Path(path)
+    df = table if isinstance(table, pd.DataFrame) else pd.DataFrame(table)
+
+    if path.suffix == ".parquet":
+        apply_dtypes(df, path.stem).to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=None)
+
+
+def read_table(path, as_saved=False):
+    """
+    Loads a table, in the format given by the file extension of path.
+    Parquet tables are read straight into Arrow-backed columns, without
+    converting through Python objects.
+
+    Args:
+        path (Path): The table to load, from table_path
+        as_saved (bool): Whether to keep values exactly as they were saved,
+            so the table can be written back unchanged. CSV values are then
+            all read as text.
+    """
+    path = pathlib.Path(path)
+    if path.suffix == ".parquet":
+        if as_saved:
+            return pd.read_parquet(path)
+        return pd.read_parquet(path, dtype_backend="pyarrow")
+    if as_saved:
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    return pd.read_csv(path)
+
+
+def patch_table(table, path, key_column, keys):
+    """
+    Replaces the rows of a saved table belonging to the given records with
+    freshly extracted ones. Rows of every other record are kept as saved,
+    and the new rows are appended after them.
+
+    Args:
+        table (DataFrame, dict or list): The rows extracted for the records,
+            in any form accepted by write_table
+        path (Path): The saved table, from table_path
+        key_column (str): The column holding record ids
+        keys (set): Ids of the records whose saved rows are replaced,
+            including deleted records, which get no new rows. Rows without
+            an id belong to the empty id.
+    """
+    path = pathlib.Path(path)
+    df = table if isinstance(table, pd.DataFrame) else pd.DataFrame(table)
+    saved = read_table(path, as_saved=True)
+
+    saved_keys = saved[key_column].fillna("").astype(str)
+    kept = saved[~saved_keys.isin(keys)]
+    if path.suffix == ".parquet":
+        df = apply_dtypes(df, path.stem)
+    write_table(pd.concat([kept, df], ignore_index=True), path)
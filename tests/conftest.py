@@ -0,0 +1,12 @@
+"""
+The pipeline scripts import their sibling modules directly, as they are run
+from their own folders, so the folders are put on the path for the tests.
+"""
+
+import pathlib
+import sys
+
+PACKAGE_DIR = pathlib.Path(__file__).parent / "../clinicaltrials"
+
+for folder in ("api", "data"):
+    sys.path.insert(0, str((PACKAGE_DIR / folder).resolve()))
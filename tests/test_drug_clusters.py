@@ -0,0 +1,39 @@
+"""
+Checks that new brand names join the cluster of a similar representative
+sharing a block key, and that clusters survive runs.
+"""
+
+from drug_clusters import DrugClusters, clean_brand_name
+
+
+def test_assign_joins_similar_representative_or_starts_cluster():
+    clusters = DrugClusters(state_path=None)
+    lipitor = clusters.new_cluster("lipitor")
+    zocor = clusters.new_cluster("zocor")
+
+    # Shares the prefix 'lipi' with 'lipitor', and is similar enough
+    assert clusters.assign(clean_brand_name("LIPITOR  XR")) == lipitor
+    # Sounds like 'zocor', but is not similar enough to join it
+    assert clusters.assign("xocor") not in (lipitor, zocor)
+    assert clusters.assign("crestor") == 3
+    # Names already clustered keep their cluster
+    assert clusters.assign("lipitor xr") == lipitor
+    assert clusters.representatives == ["lipitor", "zocor", "xocor",
+                                        "crestor"]
+
+
+def test_saved_clusters_are_reloaded(tmp_path):
+    state_path = tmp_path / "drug_clusters.json"
+    clusters = DrugClusters(state_path=state_path)
+    clusters.new_cluster("lipitor")
+    clusters.assign("lipitor xr")
+    clusters.save()
+
+    reloaded = DrugClusters(state_path=state_path)
+
+    assert reloaded.clusters == {"lipitor": 0, "lipitor xr": 0}
+    assert reloaded.representatives == ["lipitor"]
+    # Names are blocked against the reloaded representatives too
+    assert reloaded.assign("lipitorr") == 0
+    assert reloaded.assign("zocor") == 1
+    assert list(tmp_path.iterdir()) == [state_path]
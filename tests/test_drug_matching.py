@@ -0,0 +1,108 @@
+"""
+Checks that pruning candidates by their score bounds never changes which
+drugs interventions are matched to.
+"""
+
+import random
+import numpy as np
+import pandas as pd
+import pytest
+import drug_scoring
+from benchmark_drug_matching import make_catalogue, make_interventions, \
+    misspell
+from collapse_drug_data import canonical_keys, get_probable_matches
+from drug_index import TrigramIndex, char_counts
+from drug_names import drug_key
+from drug_scoring import EPSILON, JELLYFISH_SCORERS, score_bounds
+
+BACKENDS = ["rapidfuzz", "jellyfish"]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    if request.param == "rapidfuzz":
+        if drug_scoring.rapidfuzz_process is None:
+            pytest.skip("rapidfuzz is not installed")
+    else:
+        monkeypatch.setattr(drug_scoring, "rapidfuzz_process", None)
+    return request.param
+
+
+def random_names(rng, count):
+    letters = "aaeeioulmnrstbcdpxzé-"
+    return ["".join(rng.choices(letters, k=rng.randint(1, 12)))
+            for _ in range(count)]
+
+
+@pytest.mark.parametrize("scorer", ["jaro", "jaro_winkler"])
+def test_score_bounds_never_undershoot(scorer):
+    rng = random.Random(0)
+    names = random_names(rng, 300)
+    # Near misses score highest, where the bounds matter most
+    names += [misspell(name, rng) for name in names if len(name) > 1]
+    lengths = np.array([len(name) for name in names])
+    counts = np.array([char_counts(name) for name in names])
+    similarity = JELLYFISH_SCORERS[scorer]
+
+    for query in names[:200]:
+        bounds = score_bounds(query, lengths, counts, scorer)
+        scores = np.array([similarity(name, query) for name in names])
+        assert (bounds >= scores - EPSILON).all(), query
+
+
+def brute_force_matches(canonical_data, names, tolerance, scorer, top_k):
+    """
+    Matches names as get_probable_matches does, but scores every candidate
+    from the trigram index with jellyfish, without pruning.
+    """
+    _, key_names = canonical_keys(canonical_data)
+    index = TrigramIndex(key_names)
+    similarity = JELLYFISH_SCORERS[scorer]
+    matches = {}
+    for name in dict.fromkeys(name.lower() for name in names):
+        key = drug_key(name)
+        if key in key_names:
+            matches[name] = [(key_names[key], 1.0)]
+            continue
+        if not key:
+            continue
+        scored = [(-similarity(index.names[i], key), i)
+                  for i in index.candidate_ids(key)]
+        ranked = sorted(pair for pair in scored if -pair[0] >= tolerance)
+        if ranked:
+            matches[name] = [(key_names[index.names[i]], -score)
+                             for score, i in ranked[:top_k or 1]]
+    if top_k:
+        return matches
+    return {name: ranked[0][0] for name, ranked in matches.items()}
+
+
+@pytest.mark.parametrize("scorer", ["jaro", "jaro_winkler"])
+@pytest.mark.parametrize("top_k", [None, 3])
+def test_matches_equal_brute_force(tmp_path, backend, scorer, top_k):
+    rng = random.Random(1)
+    catalogue = make_catalogue(400, rng)
+    names, _ = make_interventions(catalogue, 400, rng)
+    canonical_data = pd.Series([name.upper() for name in catalogue]
+                               + [f"{name.upper()} HYDROCHLORIDE"
+                                  for name in catalogue])
+    filename = tmp_path / "trial_interventions_raw.csv"
+    pd.DataFrame({"nct_id": "NCT00000000",
+                  "intervention_name": names}).to_csv(filename, index=False)
+    tolerance = 0.8
+
+    matches = get_probable_matches(canonical_data, filename,
+                                   tolerance=tolerance, scorer=scorer,
+                                   top_k=top_k, cache_path=None)
+    expected = brute_force_matches(canonical_data, names, tolerance, scorer,
+                                   top_k)
+
+    assert matches.keys() == expected.keys()
+    for name, match in expected.items():
+        if top_k:
+            assert [drug for drug, _ in matches[name]] == \
+                [drug for drug, _ in match], name
+            assert [score for _, score in matches[name]] == \
+                pytest.approx([score for _, score in match]), name
+        else:
+            assert matches[name] == match, name
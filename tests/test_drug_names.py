@@ -0,0 +1,27 @@
+"""
+Checks that drug names are normalized into keys without case, punctuation,
+doses, dosage forms or salt forms, and that placebos have no key.
+"""
+
+import pytest
+from drug_names import drug_key
+
+
+@pytest.mark.parametrize("name, key", [
+    ("METFORMIN", "metformin"),
+    ("Metformin Hydrochloride 500 mg Tablets", "metformin"),
+    ("metformin HCl, 1,000mg oral", "metformin"),
+    ("Atorvastatin calcium 40mg/day", "atorvastatin"),
+    ("Insulin glargine 10 units/ml injection", "insulin glargine"),
+    ("Dexamethasone 0.5mg/kg", "dexamethasone"),
+    ("Doxycycline hyclate", "doxycycline"),
+    # Salt words are kept when nothing else is left
+    ("Sodium Chloride 0.9% Solution", "sodium chloride"),
+    ("Vitamin B12", "vitamin b12"),
+    ("Placebo", ""),
+    ("Matching placebo tablets", ""),
+    ("Sham Procedure", ""),
+    ("500 mg tablets", ""),
+])
+def test_drug_key(name, key):
+    assert drug_key(name) == key
@@ -0,0 +1,65 @@
+"""
+Checks that FDA pulls with more results than openFDA can skip through are
+split into date ranges, against the stand-in server.
+"""
+
+import pytest
+import fetch_fda_data
+import standin_server
+import telemetry
+from standin_server import make_synthetic_fda, serve_in_background
+
+
+@pytest.fixture
+def pull(tmp_path, monkeypatch):
+    """
+    Returns a function that serves FDA records from the stand-in server,
+    pulls them, and returns the records written.
+    """
+    monkeypatch.setattr(telemetry, "METRICS_DIR", tmp_path)
+    monkeypatch.setattr(fetch_fda_data, "MAX_SKIP", 200)
+    monkeypatch.setattr(standin_server, "MAX_SKIP", 200)
+    written = []
+    monkeypatch.setattr(fetch_fda_data, "write_data",
+                        lambda data, source, append=True:
+                        written.extend(data))
+
+    def pull(records):
+        server, url = serve_in_background([], records)
+        monkeypatch.setattr(fetch_fda_data, "FDA_API_URL",
+                            url + "/drug/drugsfda.json")
+        try:
+            fetch_fda_data.pull_fda_api_data(limit=50, requests_per_second=0)
+        finally:
+            server.shutdown()
+        return written
+
+    return pull
+
+
+def application_numbers(records):
+    return [record["application_number"] for record in records]
+
+
+def test_pull_past_max_skip_gets_every_application(pull):
+    records = make_synthetic_fda(600)
+    # Applications with submissions in both halves of a split are returned
+    # twice, and written once
+    records[0]["submissions"].append(
+        {"submission_status": "AP", "submission_status_date": "20230101"})
+
+    pulled = application_numbers(pull(records))
+
+    assert len(pulled) == len(set(pulled))
+    assert set(pulled) == set(application_numbers(records))
+
+
+def test_single_day_past_max_skip_is_capped(pull, capsys):
+    records = make_synthetic_fda(300)
+    for record in records:
+        record["submissions"][0]["submission_status_date"] = "20100101"
+
+    pulled = application_numbers(pull(records))
+
+    assert pulled == application_numbers(records)[:250]
+    assert "only the first 250 of 300" in capsys.readouterr().out
@@ -0,0 +1,153 @@
+"""
+Checks that trials pulls resume from their checkpoint after a failure, that
+delta pulls are merged into the raw data by nctId, and that sharded pulls
+are merged without duplicates and resume only unfinished shards, against
+the stand-in server.
+"""
+
+import gzip
+import json
+import pytest
+import fetch_trials_data
+import http_client
+import telemetry
+from rate_limit import RateLimiter
+from standin_server import make_synthetic_studies, serve_in_background
+
+
+@pytest.fixture
+def serve(tmp_path, monkeypatch):
+    """
+    Returns a function that serves studies from the stand-in server, with
+    the raw data written to a temporary folder.
+    """
+    monkeypatch.setattr(fetch_trials_data, "DATA_DIR", tmp_path)
+    monkeypatch.setattr(telemetry, "METRICS_DIR", tmp_path / "metrics")
+    monkeypatch.setattr(http_client, "HTTP_MODE", "live")
+    servers = []
+
+    def serve(studies):
+        server, url = serve_in_background(studies, [])
+        servers.append(server)
+        monkeypatch.setattr(fetch_trials_data, "API_URL",
+                            url + "/api/v2/studies")
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+
+
+def read_nct_ids(source):
+    with gzip.open(fetch_trials_data.raw_path(source), mode="rt") as f:
+        return [fetch_trials_data.get_nct_id(json.loads(line)) for line in f]
+
+
+def nct_ids(studies):
+    return [fetch_trials_data.get_nct_id(study) for study in studies]
+
+
+def test_resume_drops_page_written_after_checkpoint(serve, monkeypatch):
+    studies = make_synthetic_studies(1050)
+    serve(studies)
+    write_checkpoint = fetch_trials_data.write_checkpoint
+    calls = []
+
+    def fail_fifth_checkpoint(source, checkpoint):
+        calls.append(checkpoint)
+        if len(calls) == 5:
+            raise ConnectionError("lost the connection")
+        write_checkpoint(source, checkpoint)
+
+    monkeypatch.setattr(fetch_trials_data, "write_checkpoint",
+                        fail_fifth_checkpoint)
+
+    # The fifth page is written, but the pull fails before checkpointing it
+    with pytest.raises(ConnectionError):
+        fetch_trials_data.pull_trials_data(limit_per_call=100,
+                                           limiter=RateLimiter(0))
+    assert len(read_nct_ids("trials")) == 500
+
+    last_update = fetch_trials_data.pull_trials_data(limit_per_call=100,
+                                                     limiter=RateLimiter(0))
+
+    assert read_nct_ids("trials") == nct_ids(studies)
+    assert last_update == max(fetch_trials_data.get_last_update(study)
+                              for study in studies)
+    assert fetch_trials_data.load_checkpoint("trials") is None
+
+
+def set_last_update(study, date):
+    study["protocolSection"]["statusModule"]["lastUpdatePostDateStruct"] = \
+        {"date": date}
+
+
+def test_delta_sync_merges_by_nct_id(serve):
+    studies = make_synthetic_studies(300)
+    serve(studies)
+    fetch_trials_data.sync_trials_data(limit_per_call=100,
+                                       requests_per_second=0)
+    assert read_nct_ids("trials") == nct_ids(studies)
+
+    # The served list is changed in place: one study is updated, and two
+    # are added
+    studies[10]["protocolSection"]["identificationModule"]["briefTitle"] = \
+        "An Updated Study"
+    set_last_update(studies[10], "2025-03-01")
+    added = make_synthetic_studies(302)[300:]
+    for study in added:
+        set_last_update(study, "2025-03-02")
+    studies.extend(added)
+
+    fetch_trials_data.sync_trials_data(limit_per_call=100,
+                                       requests_per_second=0)
+
+    with gzip.open(fetch_trials_data.raw_path("trials"), mode="rt") as f:
+        merged = [json.loads(line) for line in f]
+    assert nct_ids(merged) == nct_ids(studies)
+    assert merged == studies
+    assert fetch_trials_data.load_sync_state() == "2025-03-02"
+    assert not fetch_trials_data.raw_path("trials_delta").exists()
+
+
+def test_sharded_pull_dedups_and_resumes_unfinished_shards(serve,
+                                                          monkeypatch,
+                                                          tmp_path):
+    studies = make_synthetic_studies(400)
+    del studies[0]["protocolSection"]["statusModule"]["startDateStruct"]
+    serve(studies)
+    # Studies starting from 2010 to 2012 are in the first two shards
+    shards = ["AREA[StartDate]RANGE[MIN,2012-12-31]",
+              "AREA[StartDate]RANGE[2010-01-01,MAX]",
+              "AREA[StartDate]MISSING"]
+    make_call = fetch_trials_data.make_trials_api_call
+    requested = []
+    failing = {shards[1]}
+
+    def call(fields, limit_per_call, pageToken=None, extra_filters=()):
+        requested.extend(extra_filters)
+        if failing & set(extra_filters):
+            raise ConnectionError("lost the connection")
+        return make_call(fields, limit_per_call, pageToken=pageToken,
+                         extra_filters=extra_filters)
+
+    monkeypatch.setattr(fetch_trials_data, "make_trials_api_call", call)
+
+    with pytest.raises(ConnectionError):
+        fetch_trials_data.pull_trials_sharded(shards=shards,
+                                              requests_per_second=0,
+                                              limit_per_call=50)
+    with open(tmp_path / "trials_shards.json") as f:
+        assert sorted(json.load(f)["done"]) == \
+            ["trials_shard_0", "trials_shard_2"]
+
+    failing.clear()
+    requested.clear()
+    last_update = fetch_trials_data.pull_trials_sharded(
+        shards=shards, requests_per_second=0, limit_per_call=50)
+
+    assert set(requested) == {shards[1]}
+    assert sorted(read_nct_ids("trials")) == nct_ids(studies)
+    assert last_update == max(fetch_trials_data.get_last_update(study)
+                              for study in studies)
+    assert sorted(path.name for path in tmp_path.iterdir()) == \
+        ["metrics", "trials.jsonl.gz"]
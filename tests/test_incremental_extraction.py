@@ -0,0 +1,98 @@
+"""
+Checks that patching the saved tables with only the changed studies gives
+the same tables as extracting every study again.
+"""
+
+import copy
+import gzip
+import json
+import pytest
+import record_hashes
+from collapse_race_data import RaceRecoder
+from extract_trials_data import EXTRACTOR_VERSION, extract_tables
+from raw_store import iter_lines
+from record_hashes import diff_hashes, hash_records, load_manifest, \
+    record_key, write_manifest
+from standin_server import make_synthetic_studies
+from table_store import patch_table, read_table, write_table
+
+
+def write_raw(path, studies):
+    with gzip.open(path, mode="wt") as f:
+        for study in studies:
+            f.write(json.dumps(study) + "\n")
+
+
+def build_tables(lines, folder, fmt):
+    tables, _ = extract_tables(lines, RaceRecoder(cache_path=None), "stdlib")
+    for name, table in tables.items():
+        write_table(table.to_frame(), folder / f"{name}.{fmt}")
+    return list(tables)
+
+
+def sorted_rows(df):
+    order = df.astype(str).sort_values(list(df.columns)).index
+    return df.loc[order].reset_index(drop=True)
+
+
+def nct_id(study):
+    return study["protocolSection"]["identificationModule"]["nctId"]
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_patched_tables_equal_full_rebuild(tmp_path, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+
+    studies = make_synthetic_studies(21, seed=1)
+    old = studies[:20]
+    new = copy.deepcopy(old)
+    # Study 3 changes, study 5 is deleted and study 20 is added
+    new[3]["protocolSection"]["statusModule"]["overallStatus"] = "WITHDRAWN"
+    new[3]["protocolSection"]["conditionsModule"]["conditions"].append(
+        "Diabetes")
+    del new[5]
+    new.append(studies[20])
+
+    write_raw(tmp_path / "old.jsonl.gz", old)
+    write_raw(tmp_path / "new.jsonl.gz", new)
+    changed, deleted = diff_hashes(
+        hash_records(tmp_path / "old.jsonl.gz", "trials"),
+        hash_records(tmp_path / "new.jsonl.gz", "trials"))
+    assert changed == {nct_id(studies[3]), nct_id(studies[20])}
+    assert deleted == {nct_id(studies[5])}
+
+    patched = tmp_path / "patched"
+    patched.mkdir()
+    build_tables(list(iter_lines(tmp_path / "old.jsonl.gz")), patched, fmt)
+    changed_lines = [line for line in iter_lines(tmp_path / "new.jsonl.gz")
+                     if record_key(line, "trials") in changed]
+    chunk, _ = extract_tables(changed_lines, RaceRecoder(cache_path=None),
+                              "stdlib")
+    for name, table in chunk.items():
+        patch_table(table.to_frame(), patched / f"{name}.{fmt}", "nct_id",
+                    changed | deleted)
+
+    full = tmp_path / "full"
+    full.mkdir()
+    names = build_tables(list(iter_lines(tmp_path / "new.jsonl.gz")), full,
+                         fmt)
+
+    for name in names:
+        expected = read_table(full / f"{name}.{fmt}", as_saved=True)
+        actual = read_table(patched / f"{name}.{fmt}", as_saved=True)
+        assert actual["nct_id"].isin([nct_id(studies[5])]).sum() == 0
+        assert expected.dtypes.equals(actual.dtypes), name
+        assert sorted_rows(actual).equals(sorted_rows(expected)), name
+
+
+def test_manifest_from_other_extractor_version_is_not_reused(tmp_path,
+                                                             monkeypatch):
+    monkeypatch.setattr(record_hashes, "TABLE_DIR", tmp_path)
+    hashes = {"NCT00000001": "abc"}
+    write_manifest("trials_csv", {"version": EXTRACTOR_VERSION}, hashes)
+
+    assert load_manifest("trials_csv",
+                         {"version": EXTRACTOR_VERSION}) == hashes
+    assert load_manifest("trials_csv",
+                         {"version": EXTRACTOR_VERSION + 1}) is None
@@ -0,0 +1,46 @@
+"""
+Checks that saved drug matches are reloaded while the matcher is unchanged,
+and discarded once the canonical names or its settings change.
+"""
+
+from match_cache import MatchCache, matcher_fingerprint
+
+SETTINGS = {"version": 1, "tolerance": 0.8, "scorer": "jaro"}
+
+
+def saved_cache(cache_path, fingerprint):
+    cache = MatchCache(fingerprint, cache_path)
+    cache.update(["metformin 500 mg", "saline"],
+                 {"metformin 500 mg": [("GLUCOPHAGE", 1.0)]})
+    cache.save()
+    return cache
+
+
+def test_matches_are_reloaded_under_the_same_fingerprint(tmp_path):
+    cache_path = tmp_path / "drug_matches.json"
+    fingerprint = matcher_fingerprint(["GLUCOPHAGE", "LIPITOR"], SETTINGS)
+    saved_cache(cache_path, fingerprint)
+
+    cache = MatchCache(fingerprint, cache_path)
+
+    assert cache.matches == {"metformin 500 mg": [("GLUCOPHAGE", 1.0)],
+                             "saline": []}
+    assert cache.missing(["saline", "aspirin"]) == ["aspirin"]
+    assert list(tmp_path.iterdir()) == [cache_path]
+
+
+def test_matches_are_discarded_when_the_fingerprint_changes(tmp_path):
+    cache_path = tmp_path / "drug_matches.json"
+    names = ["GLUCOPHAGE", "LIPITOR"]
+    fingerprint = matcher_fingerprint(names, SETTINGS)
+    saved_cache(cache_path, fingerprint)
+
+    changed = [matcher_fingerprint(names + ["ZOCOR"], SETTINGS),
+               matcher_fingerprint(names[::-1], SETTINGS),
+               matcher_fingerprint(names, {**SETTINGS, "tolerance": 0.9})]
+
+    assert fingerprint not in changed
+    for other in changed:
+        cache = MatchCache(other, cache_path)
+        assert cache.matches == {}
+        assert cache.missing(["saline"]) == ["saline"]
@@ -0,0 +1,90 @@
+"""
+Runs the whole pipeline offline: the fetchers pull synthetic records from
+the stand-in server, then the records are extracted and loaded to the
+database, each step run as a script as described in the README. The
+scripts write next to their own folder, so they are run from a copy of the
+package in a temporary folder.
+"""
+
+import gzip
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import pytest
+from conftest import PACKAGE_DIR
+from standin_server import make_synthetic_fda, make_synthetic_studies, \
+    serve_in_background
+
+
+@pytest.fixture
+def standin():
+    """
+    Serves synthetic studies and FDA records, and returns them with the
+    server's base url.
+    """
+    studies = make_synthetic_studies(300)
+    fda = make_synthetic_fda(200)
+    server, url = serve_in_background(studies, fda)
+    yield studies, fda, url
+    server.shutdown()
+
+
+def run_script(root, script, env, *args):
+    subprocess.run([sys.executable, str(root / script), *args],
+                   cwd=root, env=env, check=True, capture_output=True)
+
+
+def count_lines(path):
+    with gzip.open(path, mode="rt") as f:
+        return sum(1 for line in f if line.strip())
+
+
+@pytest.mark.parametrize("fmt", ["csv", "parquet"])
+def test_fetch_extract_makedb(tmp_path, standin, fmt):
+    if fmt == "parquet":
+        pytest.importorskip("pyarrow")
+    studies, fda, url = standin
+
+    root = tmp_path / "repo"
+    shutil.copytree(PACKAGE_DIR, root / "clinicaltrials",
+                    ignore=shutil.ignore_patterns("__pycache__"))
+    (root / "data" / "csvs").mkdir(parents=True)
+    env = {**os.environ,
+           "CLINICALTRIALS_HTTP_MODE": "live",
+           "CLINICALTRIALS_TRIALS_API_URL": url + "/api/v2/studies",
+           "CLINICALTRIALS_FDA_API_URL": url + "/drug/drugsfda.json"}
+
+    run_script(root, "clinicaltrials/api/fetch_fda_data.py", env,
+               "--requests-per-second", "0")
+    run_script(root, "clinicaltrials/api/fetch_trials_data.py", env,
+               "--requests-per-second", "0")
+    assert count_lines(root / "data" / "fda.jsonl.gz") == len(fda)
+    pulled = count_lines(root / "data" / "trials.jsonl.gz")
+    assert pulled == len(studies)
+
+    run_script(root, "clinicaltrials/data/extract_fda_data.py", env,
+               "--format", fmt)
+    run_script(root, "clinicaltrials/data/extract_trials_data.py", env,
+               "--format", fmt, "--processes", "1")
+    run_script(root, "clinicaltrials/data/makedb.py", env, "--format", fmt)
+
+    conn = sqlite3.connect(root / "data" / "trials.db")
+    try:
+        (trials,), = conn.execute("SELECT COUNT(*) FROM trials")
+        (applications,), = conn.execute("SELECT COUNT(*) FROM fda_full")
+        (joined,), = conn.execute("SELECT COUNT(*) FROM TRIALS_JOINED")
+        recoded = {name for name, in conn.execute(
+            "SELECT DISTINCT intervention_name FROM trial_interventions")}
+        brands = {name.lower() for name, in conn.execute(
+            "SELECT DISTINCT brand_name FROM fda_full")}
+    finally:
+        conn.close()
+
+    assert trials == pulled
+    assert applications == len(fda)
+    # Each study has a drug and a placebo
+    assert joined == 2 * pulled
+    # Interventions are recoded to FDA brand names
+    assert recoded & brands
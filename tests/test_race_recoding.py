@@ -0,0 +1,89 @@
+"""
+Checks that RaceRecoder classifies race category titles exactly as the
+original chain of keyword searches did, and that its cache survives runs.
+"""
+
+import itertools
+import re
+from collapse_race_data import RaceRecoder, \
+    WHITE, BLACK, ASIAN, AI_AN, HI_PI, LATINO, NOT_LATINO, MUL, UNK
+from standin_server import RACE_TITLES
+
+
+def chain_code(category):
+    """
+    The if/elif chain RaceRecoder replaced, returning None where the chain
+    left a title unmatched.
+    """
+    string_cat = str(category)
+    if re.search('multiple|more than one|multi', string_cat, flags=re.IGNORECASE):
+        return MUL
+    elif re.search('white|caucasian', string_cat, flags=re.IGNORECASE):
+        return WHITE
+    elif re.search('asian', string_cat, flags=re.IGNORECASE):
+        return ASIAN
+    elif re.search('black|african', string_cat, flags=re.IGNORECASE):
+        return BLACK
+    elif re.search('hawaiian', string_cat, flags=re.IGNORECASE):
+        return HI_PI
+    elif re.search('latin|hispanic|mexican', string_cat, flags=re.IGNORECASE):
+        return LATINO
+    elif re.search('not latin', string_cat, flags=re.IGNORECASE):
+        return NOT_LATINO
+    elif re.search('american indian|alaska|native', string_cat, flags=re.IGNORECASE):
+        return AI_AN
+    elif re.search('other|unknown|refused|not applicable|none|declined|chose not|no response|missing|prefer not|not report',\
+                    string_cat, flags=re.IGNORECASE):
+        return UNK
+    elif re.search('multiple|more than one|multi|mixed', string_cat, flags=re.IGNORECASE):
+        return MUL
+    return None
+
+
+OVERLAPPING_TITLES = [
+    "Not Hispanic or Latino",
+    "Hispanic or Latino",
+    "Asian and White",
+    "White, Asian",
+    "Black or African American and White",
+    "More than one race",
+    "Multiracial",
+    "Mixed",
+    "Mixed race, other",
+    "Native Hawaiian or Other Pacific Islander",
+    "American Indian or Alaska Native",
+    "Native American, Hispanic",
+    "Caucasian (not Latino)",
+    "Other Asian",
+    "Unknown or Not Reported",
+    "Prefer not to answer",
+    "MEXICAN AMERICAN",
+    "Declined, Black",
+    "Alaskan nAtive/white",
+    "Arab",
+    "",
+    None,
+]
+
+
+def test_classify_matches_keyword_chain():
+    recoder = RaceRecoder(cache_path=None)
+    keywords = ["white", "Asian", "black", "hawaiian", "Latino", "not latin",
+                "native", "other", "more than one", "mixed", "Hispanic"]
+    titles = OVERLAPPING_TITLES + RACE_TITLES + [
+        f"{first} {second}" for first, second
+        in itertools.permutations(keywords, 2)]
+
+    for title in titles:
+        assert recoder.classify(title) == chain_code(title), title
+
+
+def test_saved_codes_are_reloaded(tmp_path):
+    cache_path = tmp_path / "race_recoding.json"
+    recoder = RaceRecoder(cache_path=cache_path)
+    recoder.code("Asian and White")
+    recoder.save()
+
+    assert RaceRecoder(cache_path=cache_path).codes == \
+        {"Asian and White": WHITE}
+    assert list(tmp_path.iterdir()) == [cache_path]